@@ -1,8 +1,14 @@
 import os
 import joblib
+import hashlib
 
 import re
 import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, Tuple
 
 
@@ -12,7 +18,12 @@ from pymongo.server_api import ServerApi
 import bcrypt
 
 from sklearn.preprocessing import StandardScaler, OneHotEncoder, LabelEncoder
+from sklearn.pipeline import Pipeline
+from xgboost import XGBClassifier
 import pandas as pd
+import numpy as np
+from scipy.special import softmax
+import pyarrow.feather as feather
 import duckdb
 
 
@@ -354,49 +365,915 @@ class MyAIGenerator:
 
 
 
+class MyReferenceHandle:
+    """
+    Lightweight pointer to one model's reference frame in a MyReferenceStore.
+    Prediction results carry this instead of the frame; it supports the
+    df.columns / df[feature] access used for plotting.
+    """
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def frame(self):
+        return self.store.get(self.key)
+
+    @property
+    def columns(self):
+        return self.frame().columns
+
+    def __getitem__(self, feature):
+        return self.frame()[feature]
+
+    def stats(self, feature):
+        return self.store.stats(self.key)[feature]
+
+    def percentile(self, feature, value):
+        return self.store.percentile(self.key, feature, value)
+
+    def __repr__(self):
+        return f'MyReferenceHandle({self.key!r})'
+
+
+class MyReferenceStore:
+    """
+    Keeps the original_{key} reference frames resident in memory.
+
+    Each original_{key}.csv is converted once into an uncompressed Arrow IPC
+    file (original_{key}.arrow) next to it. The Arrow file is opened with a
+    memory map and every column stays Arrow-backed (pd.ArrowDtype), so several
+    app processes share the same pages through the OS cache and no CSV
+    parsing happens on the prediction path. A numpy conversion would copy
+    string columns and columns with nulls into Python objects per process.
+
+    Per-feature histograms, category counts and quantile tables come from
+    the model bundle, or reference_stats.json in older model dirs (computed
+    from the frame when neither has them), so charts never scan a full column.
+    """
+    STATS_FILENAME = 'reference_stats.json'
+
+    def __init__(self, model_dir):
+        self.model_dir = model_dir
+        self.frames = {}
+        self.handles = {}
+        self.loaded_stats = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def compute_stats(df, bins=20, n_quantiles=101):
+        """
+        Compact per-feature statistics of a reference frame.
+        Numeric → histogram (bins, counts) + sorted quantile table
+        Category → categories + counts (most frequent first)
+        """
+        stats = {}
+        for feature in df.columns:
+            col_data = df[feature].dropna()
+            # numpy or Arrow-backed (MyReferenceStore.get) columns
+            if pd.api.types.is_numeric_dtype(col_data.dtype) and not pd.api.types.is_bool_dtype(col_data.dtype):
+                data = col_data.astype(float)
+                counts, bin_edges = np.histogram(data, bins=bins)
+                quantiles = np.quantile(data, np.linspace(0, 1, n_quantiles)) if len(data) else []
+                stats[feature] = {
+                    'type': 'numeric',
+                    'n': int(len(data)),
+                    'bins': [float(b) for b in bin_edges],
+                    'counts': [int(c) for c in counts],
+                    'quantiles': [float(q) for q in quantiles],
+                }
+            else:
+                counts = col_data.value_counts()
+                stats[feature] = {
+                    'type': 'category',
+                    'n': int(len(col_data)),
+                    'categories': [c.item() if hasattr(c, 'item') else c for c in counts.index],
+                    'counts': [int(c) for c in counts.values],
+                }
+        return stats
+
+    def stats(self, key):
+        if self.loaded_stats is None:
+            with self._lock:
+                if self.loaded_stats is None:
+                    stats_path = os.path.join(self.model_dir, self.STATS_FILENAME)
+                    loaded_stats = {}
+                    if os.path.exists(stats_path):
+                        with open(stats_path, 'r', encoding='utf-8') as f:
+                            loaded_stats = json.load(f)
+                    self.loaded_stats = loaded_stats
+
+        if key not in self.loaded_stats:
+            # older model dirs have no stats file: compute once from the frame
+            self.loaded_stats[key] = self.compute_stats(self.get(key))
+        return self.loaded_stats[key]
+
+    def percentile(self, key, feature, value):
+        """Percentile (0-100) of value within the reference column, None for categories."""
+        feature_stats = self.stats(key)[feature]
+        if feature_stats['type'] != 'numeric' or not feature_stats['quantiles']:
+            return None
+        quantiles = feature_stats['quantiles']
+        return float(np.interp(float(value), quantiles, np.linspace(0, 100, len(quantiles))))
+
+    def handle(self, key):
+        handle = self.handles.get(key)
+        if handle is None:
+            handle = self.handles.setdefault(key, MyReferenceHandle(self, key))
+        return handle
+
+    def csv_path(self, key):
+        return os.path.join(self.model_dir, f'original_{key}.csv')
+
+    def arrow_path(self, key):
+        return os.path.join(self.model_dir, f'original_{key}.arrow')
+
+    def convert(self, key):
+        """Write original_{key}.arrow from the csv if it is missing or stale."""
+        csv_path = self.csv_path(key)
+        arrow_path = self.arrow_path(key)
+        if os.path.exists(arrow_path) and (
+            not os.path.exists(csv_path)
+            or os.path.getmtime(arrow_path) >= os.path.getmtime(csv_path)
+        ):
+            return arrow_path
+
+        df = pd.read_csv(csv_path)
+        tmp_path = f'{arrow_path}.tmp{os.getpid()}'
+        try:
+            feather.write_feather(df, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, arrow_path)
+        except OSError as e:
+            # read-only model dir: keep serving from the parsed csv
+            print(f"Warning: cannot write {arrow_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return df
+        print(f"Converted reference data: {key}")
+        return arrow_path
+
+    def get(self, key):
+        df = self.frames.get(key)
+        if df is not None:
+            return df
+
+        with self._lock:
+            df = self.frames.get(key)
+            if df is None:
+                source = self.convert(key)
+                if isinstance(source, pd.DataFrame):
+                    df = source
+                else:
+                    table = feather.read_table(source, memory_map=True)
+                    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+                self.frames[key] = df
+        return df
+
+
+class MyCompiledPipeline:
+    """
+    NumPy re-implementation of a fitted
+    ColumnTransformer(StandardScaler, OneHotEncoder) -> RandomOverSampler -> XGBClassifier
+    pipeline for inference. Scaling and one-hot encoding become plain array ops
+    and the booster is called through inplace_predict, so a single row skips
+    the sklearn/pandas validation stack. Output matches pipeline.predict_proba.
+
+    Raises ValueError when the pipeline has a shape it does not understand.
+    """
+    def __init__(self, pipeline):
+        preprocessor = pipeline.named_steps['preprocessor']
+        model = pipeline.named_steps['model']
+        if model.objective not in ('multi:softmax', 'multi:softprob'):
+            raise ValueError(f'unsupported objective: {model.objective}')
+
+        self.steps = []
+        self.n_output = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == 'drop' or len(columns) == 0:
+                continue
+            if isinstance(transformer, StandardScaler):
+                mean = transformer.mean_ if transformer.with_mean else np.zeros(len(columns))
+                scale = transformer.scale_ if transformer.with_std else np.ones(len(columns))
+                self.steps.append(('scale', list(columns), mean, scale))
+                self.n_output += len(columns)
+            elif isinstance(transformer, OneHotEncoder):
+                if transformer.drop is not None or transformer.handle_unknown != 'ignore':
+                    raise ValueError(f'unsupported OneHotEncoder in {name}')
+                tables = []
+                for col, categories in zip(columns, transformer.categories_):
+                    lookup = {}
+                    missing_index = None
+                    for i, cat in enumerate(categories):
+                        if self._is_missing(cat):
+                            missing_index = self.n_output + i
+                        else:
+                            lookup[cat] = self.n_output + i
+                    tables.append((col, lookup, missing_index))
+                    self.n_output += len(categories)
+                self.steps.append(('onehot', tables))
+            else:
+                raise ValueError(f'unsupported transformer: {name}')
+
+        # sparse ColumnTransformer output means zeros are "missing" for XGBoost
+        self.zero_as_missing = preprocessor.sparse_output_
+        self.objective = model.objective
+        self.booster = model.get_booster()
+        try:
+            self.iteration_range = (0, model.best_iteration + 1)
+        except AttributeError:
+            self.iteration_range = (0, 0)
+
+    @staticmethod
+    def _is_missing(value):
+        # only a float NaN is the fitted nan category; OneHotEncoder treats None
+        # as an unknown value (all zeros), so None goes through the lookup
+        return isinstance(value, float) and np.isnan(value)
+
+    def transform(self, X):
+        """X: DataFrame or dict of column name -> list of values"""
+        n_rows = len(next(iter(X.values()))) if isinstance(X, dict) else len(X)
+        Xt = np.zeros((n_rows, self.n_output), dtype=np.float64)
+
+        start = 0
+        for step in self.steps:
+            if step[0] == 'scale':
+                _, columns, mean, scale = step
+                values = np.array([np.asarray(X[c], dtype=np.float64) for c in columns]).T
+                Xt[:, start:start + len(columns)] = (values - mean) / scale
+                start += len(columns)
+            else:
+                for col, lookup, missing_index in step[1]:
+                    for row, value in enumerate(X[col]):
+                        if self._is_missing(value):
+                            j = missing_index
+                        else:
+                            j = lookup.get(value)
+                        if j is not None:
+                            Xt[row, j] = 1.0
+                    start += len(lookup) + (missing_index is not None)
+
+        if self.zero_as_missing:
+            Xt[Xt == 0] = np.nan
+        return Xt
+
+    def predict_proba(self, X):
+        return self.predict_proba_transformed(self.transform(X))
+
+    def predict_proba_transformed(self, Xt):
+        """predict_proba on the output of transform (shared between models)"""
+        if self.objective == 'multi:softmax':
+            margin = self.booster.inplace_predict(
+                Xt, iteration_range=self.iteration_range, predict_type='margin'
+            )
+            return softmax(margin, axis=1)
+        return self.booster.inplace_predict(Xt, iteration_range=self.iteration_range)
+
+    def predict(self, X):
+        return self.predict_proba(X).argmax(axis=1)
+
+
+class MyOnnxPipeline:
+    """
+    ONNX Runtime (CPU) backend for one model, built from the export written
+    by train_model.py (MyOnnxPipeline.export). The session scales lv_ columns,
+    one-hot encodes st_ columns and runs the trees; it returns the class
+    margins and softmax gives the same probabilities as pipeline.predict_proba.
+    """
+    MISSING = '__missing__'
+    # None is not a fitted category for OneHotEncoder; feed a token that never
+    # matches one so it encodes as all zeros, like sklearn
+    UNKNOWN = '__unknown__'
+
+    def __init__(self, onnx_export):
+        # optional dependency, only needed for MyModel(backend='onnx')
+        import onnxruntime as rt
+
+        # bytes, or a uint8 array (memory-mapped from the model bundle)
+        self.session = rt.InferenceSession(bytes(onnx_export['model']), providers=['CPUExecutionProvider'])
+        self.numeric = onnx_export['numeric']
+        self.category = onnx_export['category']
+
+    def _feeds(self, X):
+        """X: DataFrame or dict of column name -> list of values"""
+        feeds = {}
+        if self.numeric:
+            feeds['numeric'] = np.array(
+                [np.asarray(X[c], dtype=np.float64) for c in self.numeric]
+            ).T.reshape(-1, len(self.numeric))
+        for i, col in enumerate(self.category):
+            feeds[f'category_{i}'] = np.array([
+                self.MISSING if MyCompiledPipeline._is_missing(v)
+                else self.UNKNOWN if v is None else str(v)
+                for v in X[col]
+            ], dtype=object)
+        return feeds
+
+    @staticmethod
+    def export(pipeline):
+        """
+        ColumnTransformer(StandardScaler, OneHotEncoder) + XGBClassifier → ONNX graph
+        inputs : 'numeric' (double, lv_ columns) + 'category_{i}' (string, st_ columns)
+        output : 'margin' (float, one column per class), softmax gives predict_proba
+        """
+        # optional dependencies, only needed by train_model.py to write the export
+        from onnx import helper, TensorProto
+        from onnxmltools import convert_xgboost
+        from onnxmltools.convert.common.data_types import FloatTensorType
+
+        preprocessor = pipeline.named_steps['preprocessor']
+        model = pipeline.named_steps['model']
+        if model.objective not in ('multi:softmax', 'multi:softprob') or preprocessor.sparse_output_:
+            raise ValueError('only dense multi-class pipelines are exported to ONNX')
+
+        inputs, nodes, initializers, blocks = [], [], [], []
+        numeric_cols, category_cols = [], []
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == 'drop' or len(columns) == 0:
+                continue
+            if isinstance(transformer, StandardScaler):
+                numeric_cols = list(columns)
+                mean = transformer.mean_ if transformer.with_mean else np.zeros(len(columns))
+                scale = transformer.scale_ if transformer.with_std else np.ones(len(columns))
+                inputs.append(helper.make_tensor_value_info('numeric', TensorProto.DOUBLE, [None, len(columns)]))
+                initializers += [
+                    helper.make_tensor('mean', TensorProto.DOUBLE, [len(columns)], list(mean)),
+                    helper.make_tensor('scale', TensorProto.DOUBLE, [len(columns)], list(scale)),
+                ]
+                nodes += [
+                    helper.make_node('Sub', ['numeric', 'mean'], ['centered']),
+                    helper.make_node('Div', ['centered', 'scale'], ['scaled']),
+                    # scale in double then cast, like sklearn output fed to xgboost
+                    helper.make_node('Cast', ['scaled'], ['scaled_float'], to=TensorProto.FLOAT),
+                ]
+                blocks.append('scaled_float')
+            elif isinstance(transformer, OneHotEncoder):
+                category_cols = list(columns)
+                for i, categories in enumerate(transformer.categories_):
+                    cats = [
+                        MyOnnxPipeline.MISSING if isinstance(c, float) and np.isnan(c) else str(c)
+                        for c in categories
+                    ]
+                    inputs.append(helper.make_tensor_value_info(f'category_{i}', TensorProto.STRING, [None]))
+                    nodes.append(helper.make_node(
+                        'OneHotEncoder', [f'category_{i}'], [f'onehot_{i}'],
+                        domain='ai.onnx.ml', cats_strings=cats, zeros=1,
+                    ))
+                    blocks.append(f'onehot_{i}')
+            else:
+                raise ValueError(f'unsupported transformer: {name}')
+        nodes.append(helper.make_node('Concat', blocks, ['features'], axis=1))
+
+        # tree tables come from onnxmltools, but raw margins are emitted through a
+        # TreeEnsembleRegressor (one target per class): onnxruntime's classifier
+        # op gives wrong scores for our two-class multi:softmax models
+        tree_onnx = convert_xgboost(
+            model, initial_types=[('X', FloatTensorType([None, model.n_features_in_]))], target_opset=15
+        )
+        tree_node = next(n for n in tree_onnx.graph.node if n.op_type == 'TreeEnsembleClassifier')
+        attrs = {a.name: helper.get_attribute_value(a) for a in tree_node.attribute}
+        n_classes = int(model.n_classes_)
+        regressor_attrs = {k: v for k, v in attrs.items() if k.startswith('nodes_')}
+        regressor_attrs.update(
+            target_treeids=attrs['class_treeids'],
+            target_nodeids=attrs['class_nodeids'],
+            target_ids=attrs['class_ids'],
+            target_weights=attrs['class_weights'],
+            base_values=attrs.get('base_values', [0.0] * n_classes),
+            n_targets=n_classes,
+            aggregate_function='SUM',
+            post_transform='NONE',
+        )
+        nodes.append(helper.make_node(
+            'TreeEnsembleRegressor', ['features'], ['margin'], domain='ai.onnx.ml', **regressor_attrs
+        ))
+
+        graph = helper.make_graph(
+            nodes, 'disease_model', inputs,
+            [helper.make_tensor_value_info('margin', TensorProto.FLOAT, [None, n_classes])],
+            initializers,
+        )
+        onnx_model = helper.make_model(
+            graph,
+            opset_imports=[helper.make_opsetid('', 15), helper.make_opsetid('ai.onnx.ml', 3)],
+            ir_version=8,
+        )
+        return {
+            # uint8 array, so joblib stores it memory-mappable in the bundle
+            'model': np.frombuffer(onnx_model.SerializeToString(), dtype=np.uint8),
+            'numeric': numeric_cols,
+            'category': category_cols,
+        }
+
+    def predict_proba(self, X):
+        margin = self.session.run(['margin'], self._feeds(X))[0]
+        return softmax(margin, axis=1)
+
+    def predict(self, X):
+        return self.predict_proba(X).argmax(axis=1)
+
+
+class MyPredictionCache:
+    """
+    Bounded LRU cache of single-row predictions.
+    Entries are keyed per model on the canonicalised values of that model's
+    own features, so a change to an unrelated field does not invalidate it.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def canonical(value):
+        # 25 (int) and 25.0 (float) are the same model input, NaN is missing
+        if value is None:
+            return None
+        if isinstance(value, (bool, np.bool_)):
+            return bool(value)
+        if isinstance(value, (int, float, np.number)):
+            value = float(value)
+            return None if np.isnan(value) else value
+        return value
+
+    def make_key(self, model_key, feature_input):
+        return (model_key, tuple(self.canonical(v) for v in feature_input.values()))
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+class MyModelVersion:
+    """
+    Everything loaded from one version of the Models dir: list_features, model
+    keys, loaded pipelines and reference store. MyModel swaps the whole object
+    on reload; a prediction reads MyModel.models once and keeps using that
+    object, so it finishes on the version it started with.
+    """
+    def __init__(self, model_dir, signature=None):
+        self.model_dir = model_dir
+        self.signature = signature
+        self.version = None
+        self.list_features = None
+        self.model_keys = []
+        self.pipelines = {}
+        # inference exports read from the bundle, turned into pipelines on first use
+        self.bundle_models = {}
+        self.load_timings = {}
+        self.reference_store = MyReferenceStore(model_dir)
+        self.load_locks = {}
+
+
 class MyModel:
-    def __init__(self):
+    # single artifact written by train_model.py
+    # format 1: full training pipelines, format 2: inference-only models
+    BUNDLE_FILENAME = 'model_bundle.joblib'
+    BUNDLE_FORMAT = 2
+    # files written by train_model.py; a change in any of them is a new version
+    # (.arrow files are generated next to the csv by the app itself)
+    WATCHED_EXTENSIONS = ('.joblib', '.json', '.csv')
+    # published layout written by train_model.py:
+    #   Models/versions/<version>/  bundle, reference csv/arrow, manifest.json
+    #   Models/current.json         {"version": ...}, replaced atomically on publish
+    # without current.json the files directly in Models are used
+    VERSIONS_DIRNAME = 'versions'
+    MANIFEST_FILENAME = 'manifest.json'
+    CURRENT_FILENAME = 'current.json'
+    # rebuilt from the csv by MyReferenceStore and git-ignored, so a checkout
+    # may not have them: left out of the manifest
+    UNVERIFIED_EXTENSIONS = ('.arrow',)
+
+    def __init__(self, use_compiled=False, cache_size=1024, n_workers=0, backend='joblib'):
         self.model_dir = os.path.join(os.path.dirname(__file__), 'Models')
-        self.loaded_list_features = None
-        self.loaded_pipelines = {}
-        
-        self._load_model_and_feature()
+        self.use_compiled = use_compiled
+        # 'joblib' (sklearn/XGBoost, optionally compiled) or 'onnx' (onnxruntime)
+        self.backend = backend
+        self.prediction_cache = MyPredictionCache(cache_size)
+        # n_workers > 1: score the models concurrently on a shared thread pool
+        self.n_workers = n_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._preload_lock = threading.Lock()
+        self.warm_up_timings = {}
+        self.ready = threading.Event()
+        self._warm_up_thread = None
+        self._reload_lock = threading.Lock()
+        self._watch_thread = None
+        self._stop_watching = threading.Event()
+
+        self.models = self._load_model_and_feature()
 
         pass
-    
+
+    # the live version, kept as attributes for existing callers
+    @property
+    def model_version(self):
+        return self.models.version
+
+    @property
+    def loaded_list_features(self):
+        return self.models.list_features
+
+    @property
+    def model_keys(self):
+        return self.models.model_keys
+
+    @property
+    def loaded_pipelines(self):
+        return self.models.pipelines
+
+    @property
+    def load_timings(self):
+        return self.models.load_timings
+
+    @property
+    def reference_store(self):
+        return self.models.reference_store
+
+    @staticmethod
+    def file_checksum(file_path):
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @classmethod
+    def publish(cls, model_dir, version):
+        """
+        Make Models/versions/<version> the live version. current.json is written
+        to a temp file and renamed over the old one, so readers see either the
+        old or the new version, never a mix. Also used to roll back.
+        """
+        version_dir = os.path.join(model_dir, cls.VERSIONS_DIRNAME, version)
+        if not os.path.exists(os.path.join(version_dir, cls.MANIFEST_FILENAME)):
+            raise ValueError(f"No manifest in {version_dir}, not publishing.")
+
+        current_path = os.path.join(model_dir, cls.CURRENT_FILENAME)
+        tmp_path = current_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version}, f)
+        os.replace(tmp_path, current_path)
+
+    def _verify_manifest(self, version_dir):
+        with open(os.path.join(version_dir, self.MANIFEST_FILENAME), 'r') as f:
+            manifest = json.load(f)
+        for filename, expected in manifest['files'].items():
+            if filename.endswith(self.UNVERIFIED_EXTENSIONS):
+                # listed by manifests written before they were left out
+                continue
+            file_path = os.path.join(version_dir, filename)
+            if (not os.path.exists(file_path)
+                    or os.path.getsize(file_path) != expected['size']
+                    or self.file_checksum(file_path) != expected['sha256']):
+                raise ValueError(f"Checksum mismatch for {filename} in {version_dir}")
+
+    def _published_dir(self):
+        """
+        Version dir named by current.json, checked against its manifest. When it
+        does not verify, the newest version that does; None (the Models dir
+        itself) when there is no current.json or no version verifies.
+        """
+        current_path = os.path.join(self.model_dir, self.CURRENT_FILENAME)
+        if not os.path.exists(current_path):
+            return None
+        try:
+            with open(current_path, 'r') as f:
+                version = json.load(f)['version']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: cannot read {self.CURRENT_FILENAME}. {e}")
+            version = None
+
+        versions_dir = os.path.join(self.model_dir, self.VERSIONS_DIRNAME)
+        others = sorted(os.listdir(versions_dir), reverse=True) if os.path.isdir(versions_dir) else []
+        for candidate in [version] + [v for v in others if v != version]:
+            if candidate is None:
+                continue
+            version_dir = os.path.join(versions_dir, candidate)
+            try:
+                self._verify_manifest(version_dir)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: model version {candidate} does not verify, skipping. {e}")
+                continue
+            if candidate != version:
+                print(f"Warning: serving model version {candidate} instead of {version}.")
+            return version_dir
+        print(f"Warning: no model version verifies, using {self.model_dir}.")
+        return None
+
+    def _dir_signature(self):
+        """
+        (name, mtime, size) of current.json once models are published, else of
+        the files train_model.py writes into the Models dir.
+        """
+        current_path = os.path.join(self.model_dir, self.CURRENT_FILENAME)
+        if os.path.exists(current_path):
+            stat = os.stat(current_path)
+            return ((self.CURRENT_FILENAME, stat.st_mtime_ns, stat.st_size),)
+
+        signature = []
+        for filename in sorted(os.listdir(self.model_dir)):
+            if not filename.endswith(self.WATCHED_EXTENSIONS):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.model_dir, filename))
+            except FileNotFoundError:
+                continue
+            signature.append((filename, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
     def _load_model_and_feature(self):
-        model_dir = self.model_dir
+        """
+        Open the published version (current.json) or else the Models dir itself.
+        Open the model bundle when there is one. Older model dirs with one
+        $$pipeline / $$le file per model are read per file, lazily on first use.
+        """
+        signature = self._dir_signature()
+        model_dir = self._published_dir() or self.model_dir
+        models = MyModelVersion(model_dir, signature)
+        bundle_path = os.path.join(model_dir, self.BUNDLE_FILENAME)
+        if os.path.exists(bundle_path):
+            self._load_bundle(models, bundle_path)
+            return models
+
         for filename in os.listdir(model_dir):
             if filename == 'list_features.json':
                 with open(os.path.join(model_dir, filename), 'r') as f:
-                    self.loaded_list_features = json.load(f)
+                    models.list_features = json.load(f)
                     print(f"Loaded list_features")
                 continue
 
             if filename.endswith('$$pipeline.joblib'):
                 key = filename.replace('$$pipeline.joblib', '')
-                pipeline_path = os.path.join(model_dir, filename)
                 le_path = os.path.join(model_dir, f'{key}$$le.joblib')
 
                 if os.path.exists(le_path):
-                    pipeline = self._load_pipeline(pipeline_path)
-                    le = self._load_le(le_path)
-                    self.loaded_pipelines[key] = {
-                        'pipeline': pipeline,
-                        'le': le,
-                    }
-                    print(f"Loaded model: {key}")
+                    models.model_keys.append(key)
+                    models.load_locks[key] = threading.Lock()
                 else:
                     print(f"Warning: Missing label encoder for {key}. Skipping.")
 
+        # no version stored in the per-file layout: use the newest file time
+        newest = max((mtime for _, mtime, _ in signature), default=0)
+        models.version = time.strftime('%Y%m%d-%H%M%S', time.localtime(newest / 1e9))
+        return models
+
+    def _load_bundle(self, models, bundle_path):
+        start = time.perf_counter()
+        # one sequential read; numpy arrays inside (boosters, ONNX graphs, fitted
+        # scaler statistics) stay memory-mapped until a model is first used
+        bundle = joblib.load(bundle_path, mmap_mode='r')
+        if bundle.get('format') not in (1, self.BUNDLE_FORMAT):
+            raise ValueError(f"Unsupported model bundle format: {bundle.get('format')}")
+
+        models.version = bundle['version']
+        models.list_features = bundle['list_features']
+        models.reference_store.loaded_stats = bundle['reference_stats']
+        for key, model in bundle['models'].items():
+            models.model_keys.append(key)
+            models.load_locks[key] = threading.Lock()
+            models.bundle_models[key] = model
+        models.load_timings[self.BUNDLE_FILENAME] = time.perf_counter() - start
+        print(f"Loaded model bundle: {models.version} ({models.load_timings[self.BUNDLE_FILENAME]:.3f}s)")
+
+    @staticmethod
+    def export_inference_model(pipeline, le):
+        # predict-only: fitted preprocessor + raw booster + label encoder,
+        # RandomOverSampler (a no-op at predict time) and imblearn are dropped
+        booster = pipeline.named_steps['model'].get_booster()
+        return {
+            'preprocessor': pipeline.named_steps['preprocessor'],
+            # uint8 array, so joblib stores it memory-mappable in the bundle
+            'booster': np.frombuffer(booster.save_raw(raw_format='ubj'), dtype=np.uint8),
+            'le': le,
+        }
+
+    def _build_inference_pipeline(self, model):
+        """
+        Rebuild a predict-only pipeline from an inference-only export:
+        fitted preprocessor + raw XGBoost booster (no imblearn, no oversampler).
+        """
+        classifier = XGBClassifier()
+        # bytes (older bundles) or a memory-mapped uint8 array; XGBoost parses
+        # it into its own trees, so the copy here is only the raw model
+        classifier.load_model(bytearray(model['booster']))
+        return Pipeline([
+            ('preprocessor', model['preprocessor']),
+            ('model', classifier),
+        ])
+
+    def _make_entry(self, models, key, pipeline, le, model=None):
+        compiled = self._compile_pipeline(key, pipeline, model)
+        preprocess_key = None
+        if not isinstance(compiled, MyOnnxPipeline):
+            # models with the same features, an identical fitted preprocessor and
+            # the same transform implementation (compiled or sklearn; their
+            # matrices differ in layout) share one transform per prediction,
+            # e.g. Kidney Label1/Label2
+            preprocess_key = (
+                tuple(models.list_features[key]),
+                joblib.hash(pipeline.named_steps['preprocessor']),
+                compiled is not None,
+            )
+        return {
+            'pipeline': pipeline,
+            'le': le,
+            'compiled': compiled,
+            'preprocess_key': preprocess_key,
+        }
+
+    def _get_loaded_pipeline(self, models, key):
+        entry = models.pipelines.get(key)
+        if entry is not None:
+            return entry
+
+        with models.load_locks[key]:
+            entry = models.pipelines.get(key)
+            if entry is None:
+                start = time.perf_counter()
+                model = models.bundle_models.get(key)
+                if model is None:
+                    pipeline = self._load_pipeline(os.path.join(models.model_dir, f'{key}$$pipeline.joblib'))
+                    le = self._load_le(os.path.join(models.model_dir, f'{key}$$le.joblib'))
+                elif 'booster' in model:
+                    pipeline, le = self._build_inference_pipeline(model), model['le']
+                else:
+                    pipeline, le = model['pipeline'], model['le']
+                entry = self._make_entry(models, key, pipeline, le, model)
+                models.load_timings[key] = time.perf_counter() - start
+                models.pipelines[key] = entry
+                print(f"Loaded model: {key} ({models.load_timings[key]:.3f}s)")
+        return entry
+
+    def preload(self):
+        """
+        Load every model now, in this thread. For a background load use
+        warm_up(background=True), which also primes every model.
+        """
+        models = self.models
+        for key in models.model_keys:
+            self._get_loaded_pipeline(models, key)
+
+    def _synthetic_input(self, models):
+        """One plausible input row: median of numeric features, most frequent category."""
+        input_data = {}
+        for key in models.model_keys:
+            stats = models.reference_store.stats(key)
+            for feature in models.list_features[key]:
+                feature_stats = stats.get(feature)
+                if feature in input_data or feature_stats is None:
+                    continue
+                if feature_stats['type'] == 'numeric' and feature_stats['quantiles']:
+                    quantiles = feature_stats['quantiles']
+                    input_data[feature] = quantiles[len(quantiles) // 2]
+                elif feature_stats['type'] == 'category' and feature_stats['categories']:
+                    input_data[feature] = feature_stats['categories'][0]
+        return input_data
+
+    def _warm_up_models(self, models):
+        """Run a synthetic row through every model of `models`; return {key: seconds}."""
+        timings = {}
+        input_data = self._synthetic_input(models)
+        input_dict = self._get_dict_feature(models.list_features, input_data)
+        df_input = pd.DataFrame([input_data])
+        for key in models.model_keys:
+            loaded = self._get_loaded_pipeline(models, key)
+            start = time.perf_counter()
+            self._predict(loaded, self._single_row_frame(models, key, loaded, input_dict[key]), {})
+            self._predict_batch_one_model(models, key, df_input, {})
+            timings[key] = time.perf_counter() - start
+        return timings
+
+    def warm_up(self, background=False):
+        """
+        Load every model and run a synthetic row through the single-row and the
+        batch path, so XGBoost / sklearn / pandas first-call setup is paid here
+        instead of by the first user. `ready` is set when done and the per-model
+        times are in warm_up_timings. With background=True it runs once in a
+        daemon thread.
+        """
+        if background:
+            with self._preload_lock:
+                if self._warm_up_thread is None:
+                    self._warm_up_thread = threading.Thread(
+                        target=self.warm_up, name='MyModel-warm-up', daemon=True
+                    )
+                    self._warm_up_thread.start()
+            return
+
+        try:
+            self.warm_up_timings = self._warm_up_models(self.models)
+            print(f"Warm-up done: {', '.join(f'{k} {t:.3f}s' for k, t in self.warm_up_timings.items())}")
+        except Exception as e:
+            print(f"Warning: warm-up failed. {e}")
+        finally:
+            self.ready.set()
+
+    def reload(self):
+        """
+        Load the Models dir as a new version next to the live one, load and
+        warm up all its models, then swap it in with one assignment. Predictions
+        already running keep the version they started with. Returns True when a
+        new version was swapped in.
+        """
+        with self._reload_lock:
+            current = self.models
+            models = self._load_model_and_feature()
+            if models.version == current.version and models.signature == current.signature:
+                return False
+            if not models.model_keys:
+                raise ValueError(f"No models found in {models.model_dir}")
+
+            timings = self._warm_up_models(models)
+            self.models = models
+            self.warm_up_timings = timings
+            print(f"Swapped model version: {current.version} -> {models.version}")
+            return True
+
+    def watch(self, interval=30):
+        """
+        Poll the Models dir every `interval` seconds from a daemon thread
+        (started once) and reload() when its files change. A change has to be
+        stable for one interval, so a half-written Models dir is not loaded.
+        A failed reload keeps serving the live version.
+        """
+        with self._reload_lock:
+            if self._watch_thread is None:
+                self._stop_watching.clear()
+                self._watch_thread = threading.Thread(
+                    target=self._watch, args=(interval,), name='MyModel-watch', daemon=True
+                )
+                self._watch_thread.start()
+
+    def stop_watching(self):
+        self._stop_watching.set()
+        thread = self._watch_thread
+        if thread is not None:
+            thread.join()
+        self._watch_thread = None
+
+    def _watch(self, interval):
+        pending = None
+        while not self._stop_watching.wait(interval):
+            try:
+                signature = self._dir_signature()
+                if signature == self.models.signature:
+                    pending = None
+                elif signature != pending:
+                    pending = signature
+                else:
+                    pending = None
+                    self.reload()
+            except Exception as e:
+                print(f"Warning: model reload failed, keeping {self.models.version}. {e}")
+
     def _load_pipeline(self, file_path):
         with open(file_path, 'rb') as file:
             return joblib.load(file)
-            
+
     def _load_le(self, file_path):
         with open(file_path, 'rb') as file:
             return joblib.load(file)
 
+    def _compile_pipeline(self, key, pipeline, model=None):
+        """Fast predictor that works on plain columns, None for the sklearn pipeline."""
+        if self.backend == 'onnx':
+            if model is not None and 'onnx' in model:
+                return MyOnnxPipeline(model['onnx'])
+            print(f"Warning: no ONNX export for {key}, using joblib backend.")
+        if not self.use_compiled:
+            return None
+        try:
+            return MyCompiledPipeline(pipeline)
+        except (ValueError, KeyError, AttributeError) as e:
+            print(f"Warning: cannot compile {key}, using sklearn pipeline. {e}")
+            return None
+
     def _get_dict_feature(self, list_features, input_data):
         model_input_dicts = {}
 
@@ -411,34 +1288,294 @@ class MyModel:
             result[model_name] = data
 
         return result
-    
+
+    def _predict(self, loaded, df_new, shared):
+        """
+        shared: {preprocess_key: transformed matrix} for the models of one group,
+        so the preprocessing runs once per group and input.
+        """
+        compiled = loaded['compiled']
+        preprocess_key = loaded['preprocess_key']
+        if preprocess_key is None:
+            y_prob_new = compiled.predict_proba(df_new)
+        else:
+            if compiled is not None:
+                transform = compiled.transform
+                predict_proba_transformed = compiled.predict_proba_transformed
+            else:
+                transform = loaded['pipeline'].named_steps['preprocessor'].transform
+                predict_proba_transformed = loaded['pipeline'].named_steps['model'].predict_proba
+
+            Xt = shared.get(preprocess_key)
+            if Xt is None:
+                Xt = shared[preprocess_key] = transform(df_new)
+            y_prob_new = predict_proba_transformed(Xt)                # array([[0.3, 0.7]]) for example
+
+        # run the model once: the label is the argmax of the probabilities,
+        # same as pipeline.predict for the multi:softmax models
+        y_pred_new = loaded['le'].inverse_transform(y_prob_new.argmax(axis=1))  # array([1])
+        return y_pred_new, y_prob_new
+
+    def _get_executor(self):
+        if self.n_workers is None or self.n_workers <= 1:
+            return None
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.n_workers, thread_name_prefix='MyModel'
+                )
+        return self._executor
+
+    def _model_groups(self, models):
+        """Model keys grouped by preprocess_key (models that can share a transform)."""
+        groups = {}
+        for key in models.model_keys:
+            preprocess_key = self._get_loaded_pipeline(models, key)['preprocess_key'] or key
+            groups.setdefault(preprocess_key, []).append(key)
+        return list(groups.values())
+
+    def _map_group(self, func, models, keys, *args):
+        shared = {}
+        return {key: func(models, key, *args, shared) for key in keys}
+
+    def _map_models(self, models, func, *args):
+        """
+        Run func(models, key, *args, shared) for every model and return {key: result}.
+        Models of one preprocessing group run together and share `shared`.
+        XGBoost releases the GIL in inplace_predict (which is thread-safe), so
+        the pool lets the slowest group set the latency instead of the sum.
+        """
+        groups = self._model_groups(models)
+        executor = self._get_executor()
+        results = {}
+        if executor is None:
+            for keys in groups:
+                results.update(self._map_group(func, models, keys, *args))
+        else:
+            futures = [executor.submit(self._map_group, func, models, keys, *args) for keys in groups]
+            for future in futures:
+                results.update(future.result())
+        return {key: results[key] for key in models.model_keys}
+
+    def _single_row_frame(self, models, key, loaded, feature_input):
+        # compiled fast path works on plain columns, no DataFrame needed
+        if loaded['compiled'] is not None:
+            return {f: [v] for f, v in feature_input.items()}
+        return pd.DataFrame([feature_input.values()], columns=models.list_features[key])
+
+    def _predict_one_model(self, models, key, input_dict, shared):
+        cache_key = self.prediction_cache.make_key((models.version, key), input_dict[key])
+        cached = self.prediction_cache.get(cache_key)
+        if cached is not None:
+            y_pred_new, y_prob_new = cached
+        else:
+            loaded = self._get_loaded_pipeline(models, key)
+            df_new = self._single_row_frame(models, key, loaded, input_dict[key])
+            y_pred_new, y_prob_new = self._predict(loaded, df_new, shared)
+            self.prediction_cache.put(cache_key, (y_pred_new, y_prob_new))
+
+        # print(key, "y_pred_new:", y_pred_new)
+        # print(key, "y_prob_new:", y_prob_new)
+        return {
+            'predict': y_pred_new[0],
+            'probability': y_prob_new[0].max(),
+            'prob': y_prob_new[0],
+            'feature_input': input_dict[key],
+            'reference': models.reference_store.handle(key),
+            'version': models.version
+        }
+
     def predict_all_models(self, _input_data):
-        input_dict = self._get_dict_feature(self.loaded_list_features, _input_data)
+        models = self.models
+        input_dict = self._get_dict_feature(models.list_features, _input_data)
+        return self._map_models(models, self._predict_one_model, input_dict)
 
-        all_predict = {}
-        for key in self.loaded_pipelines:
-            data = [input_dict[key].values()]
-            
-            original_df = pd.read_csv(os.path.join(self.model_dir, f'original_{key}.csv'))
-
-            df_new = pd.DataFrame(data, columns=self.loaded_list_features[key])
-
-            # full pipeline stored in 'model'
-            pipeline = self.loaded_pipelines[key]['pipeline']
-            le = self.loaded_pipelines[key]['le']
-
-            # Predict class labels (1D array)
-            y_pred_new = le.inverse_transform(pipeline.predict(df_new))  # array([1])
-            y_prob_new = pipeline.predict_proba(df_new)                  # array([[0.3, 0.7]]) for example
-
-            # print(key, "y_pred_new:", y_pred_new)
-            # print(key, "y_prob_new:", y_prob_new)
-            all_predict[key] = {
-                'predict': y_pred_new[0],
-                'probability': y_prob_new[0].max(),
-                'prob': y_prob_new[0],
-                'feature_input': input_dict[key],
-                'original_df': original_df
-            }
-        return all_predict
 
+    def _get_batch_frame(self, input_data):
+        if isinstance(input_data, pd.DataFrame):
+            return input_data
+        return pd.DataFrame.from_records(list(input_data))
+
+    def _predict_batch_one_model(self, models, key, df_input, shared):
+        # missing features become None, like input_data.get(feature, None) for one row
+        features = models.list_features[key]
+        df_new = df_input.reindex(columns=features)
+        for feature in features:
+            if feature not in df_input.columns:
+                df_new[feature] = pd.Series(None, index=df_new.index, dtype=object)
+
+        loaded = self._get_loaded_pipeline(models, key)
+        le = loaded['le']
+
+        y_pred_new, y_prob_new = self._predict(loaded, df_new, shared)
+
+        df_result = pd.DataFrame(
+            y_prob_new,
+            index=df_input.index,
+            columns=[f'prob_{c}' for c in le.classes_],
+        )
+        df_result.insert(0, 'predict', y_pred_new)
+        df_result.insert(1, 'probability', y_prob_new.max(axis=1))
+        df_result.insert(2, 'version', models.version)
+        return df_result
+
+    def _predict_all_models_batch(self, models, input_data):
+        df_input = self._get_batch_frame(input_data)
+        return self._map_models(models, self._predict_batch_one_model, df_input)
+
+    def predict_all_models_batch(self, input_data):
+        """
+        Score many patients at once.
+        input_data: DataFrame or iterable of input dicts (same keys as predict_all_models)
+        return: {model key: DataFrame indexed like the input with columns
+                 'predict', 'probability', 'version' and one probability column per class}
+        """
+        return self._predict_all_models_batch(self.models, input_data)
+
+
+class MyMicroBatcher:
+    """
+    Opt-in micro-batching in front of a shared MyModel.
+
+    Requests that arrive within window_ms of the first queued one are scored
+    together through MyModel.predict_all_models_batch (one matrix per model)
+    and every caller gets its own predict_all_models-style result through a
+    Future. stats() reports latency/throughput counters to tune the window.
+    """
+    def __init__(self, model, window_ms=10, max_batch_size=64):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+
+        self.n_requests = 0
+        self.n_batches = 0
+        self.max_batch_seen = 0
+        self.total_queue_wait = 0.0
+        self.total_latency = 0.0
+        self._started_at = time.perf_counter()
+        self._stats_lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='MyMicroBatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, input_data):
+        future = Future()
+        self._queue.put((time.perf_counter(), input_data, future))
+        return future
+
+    def predict_all_models(self, input_data, timeout=None):
+        return self.submit(input_data).result(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = item[0] + self.window
+            closing = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+
+            self._score(batch)
+            if closing:
+                return
+
+    def _score(self, batch):
+        started = time.perf_counter()
+        model = self.model
+        # one version for the whole batch, even if the model reloads meanwhile
+        models = model.models
+        try:
+            try:
+                results = model._predict_all_models_batch(models, [input_data for _, input_data, _ in batch])
+            except Exception:
+                # e.g. one unparseable value fails the whole matrix
+                results = None
+
+            if results is None:
+                self._score_each(models, batch)
+            else:
+                self._set_results(models, batch, results)
+
+            finished = time.perf_counter()
+            with self._stats_lock:
+                self.n_requests += len(batch)
+                self.n_batches += 1
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                self.total_queue_wait += sum(started - submitted for submitted, _, _ in batch)
+                self.total_latency += sum(finished - submitted for submitted, _, _ in batch)
+        except Exception as e:
+            # no caller may wait forever; futures already answered keep their result
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _set_results(self, models, batch, results):
+        model = self.model
+        columns = {}
+        for key, df_result in results.items():
+            prob_cols = [c for c in df_result.columns if c.startswith('prob_')]
+            columns[key] = (
+                df_result['predict'].to_numpy(),
+                df_result[prob_cols].to_numpy(),
+                models.reference_store.handle(key),
+            )
+
+        for i, (submitted, input_data, future) in enumerate(batch):
+            input_dict = model._get_dict_feature(models.list_features, input_data)
+            all_predict = {}
+            for key, (y_pred, y_prob, reference) in columns.items():
+                all_predict[key] = {
+                    'predict': y_pred[i],
+                    'probability': y_prob[i].max(),
+                    'prob': y_prob[i],
+                    'feature_input': input_dict[key],
+                    'reference': reference,
+                    'version': models.version
+                }
+            future.set_result(all_predict)
+
+    def _score_each(self, models, batch):
+        """
+        Score every request of a failed batch on its own (predict_all_models,
+        on the batch's version), so only the requests that fail by themselves
+        get the exception.
+        """
+        model = self.model
+        for _, input_data, future in batch:
+            try:
+                input_dict = model._get_dict_feature(models.list_features, input_data)
+                future.set_result(model._map_models(models, model._predict_one_model, input_dict))
+            except Exception as e:
+                future.set_exception(e)
+
+    def stats(self):
+        with self._stats_lock:
+            n_requests = self.n_requests
+            elapsed = time.perf_counter() - self._started_at
+            return {
+                'requests': n_requests,
+                'batches': self.n_batches,
+                'avg_batch_size': n_requests / self.n_batches if self.n_batches else 0.0,
+                'max_batch_size': self.max_batch_seen,
+                'avg_queue_wait_ms': 1000 * self.total_queue_wait / n_requests if n_requests else 0.0,
+                'avg_latency_ms': 1000 * self.total_latency / n_requests if n_requests else 0.0,
+                'throughput_per_s': n_requests / elapsed if elapsed > 0 else 0.0,
+            }
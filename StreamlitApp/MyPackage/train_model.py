@@ -1,10 +1,26 @@
 import pandas as pd
 import numpy as np
 import re
+import os
+import sys
+import json
+import time
+import hashlib
+import datetime as dt
+import urllib.request
+import pyarrow as pa
+import pyarrow.feather as feather
 
 
 url = 'https://github.com/siriwatsc-debug/Project-DataProduct/raw/refs/heads/main/Dataset/AllDataset_Edit_Final_R04.xlsx'
 
+# workbook: path given on the command line, else Dataset/AllDataset_Edit_Final_R04.xlsx
+# (downloaded from url once when missing). Sheets are cached as Arrow files in
+# Dataset/cache/<sha256 of the workbook>/, so openpyxl only runs for a new workbook.
+DATASET_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Dataset'))
+SHEET_CACHE_DIR = os.path.join(DATASET_DIR, 'cache')
+workbook_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(DATASET_DIR, os.path.basename(url))
+
 
 # ชื่อโรค $ label column : ชื่อ sheet ที่ต้องการ train
 target_dataframes = {
@@ -19,7 +35,135 @@ sh_data_dic = 'Data Dic (Not Duplicate Item)'
 
 
 
-excel_df = pd.read_excel(url, sheet_name=None, header=None)
+# -----------------------------
+# Ingestion: workbook -> {sheet name: DataFrame}, same frames as
+# pd.read_excel(workbook, sheet_name=None, header=None)
+# -----------------------------
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+# header=None leaves the header rows in the data, so most columns hold several
+# cell types. Object columns are stored as one typed Arrow column per cell type
+# ("<i>.int", "<i>.str", ...) and put back together cell by cell when read.
+CELL_TYPES = {
+    'int': pa.int64(),
+    'float': pa.float64(),
+    'bool': pa.bool_(),
+    'str': pa.string(),
+    'datetime': pa.timestamp('us'),
+    'time': pa.time64('us'),
+}
+
+def cell_type(value):
+    if isinstance(value, (bool, np.bool_)):
+        return 'bool'
+    if isinstance(value, (int, np.integer)):
+        return 'int'
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else 'float'
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, dt.datetime):
+        return 'datetime'
+    if isinstance(value, dt.time):
+        return 'time'
+    if value is None:
+        return None
+    raise ValueError(f"cannot cache cell of type {type(value).__name__}")
+
+def sheet_to_table(df):
+    arrays, names, layout = [], [], []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        layout.append({'name': column, 'dtype': str(values.dtype)})
+        if values.dtype != object:
+            arrays.append(pa.array(values.to_numpy()))
+            names.append(str(i))
+            continue
+        types = values.map(cell_type)
+        for t in types.dropna().unique():
+            cells = values.where(types == t, None).tolist()
+            arrays.append(pa.array(cells, type=CELL_TYPES[t]))
+            names.append(f'{i}.{t}')
+    return pa.table(arrays, names=names), layout
+
+def table_to_sheet(table, layout):
+    columns = {}
+    by_column = {}
+    for name in table.column_names:
+        i, _, t = name.partition('.')
+        by_column.setdefault(int(i), []).append((name, t))
+    for i, info in enumerate(layout):
+        parts = by_column.get(i, [])
+        if info['dtype'] != 'object':
+            columns[info['name']] = table.column(parts[0][0]).to_pandas().astype(info['dtype'])
+            continue
+        values = np.full(table.num_rows, np.nan, dtype=object)
+        for name, t in parts:
+            cells = table.column(name)
+            mask = cells.is_valid().to_numpy(zero_copy_only=False)
+            values[mask] = np.array(cells.to_pylist(), dtype=object)[mask]
+        columns[info['name']] = values
+    return pd.DataFrame(columns)
+
+def read_workbook(workbook_path):
+    start = time.perf_counter()
+    if os.path.exists(workbook_path):
+        cache_dir = os.path.join(SHEET_CACHE_DIR, file_sha256(workbook_path))
+    else:
+        try:
+            print('downloading', url)
+            os.makedirs(os.path.dirname(workbook_path), exist_ok=True)
+            urllib.request.urlretrieve(url, workbook_path + '.tmp')
+            os.replace(workbook_path + '.tmp', workbook_path)
+            cache_dir = os.path.join(SHEET_CACHE_DIR, file_sha256(workbook_path))
+        except OSError as e:
+            # offline without the workbook: last cached version
+            latest_path = os.path.join(SHEET_CACHE_DIR, 'latest.json')
+            if not os.path.exists(latest_path):
+                raise
+            with open(latest_path, 'r') as f:
+                cache_dir = os.path.join(SHEET_CACHE_DIR, json.load(f)['sha256'])
+            print(f'>>>>>>>>>> cannot download workbook ({e}), using cache {cache_dir}')
+
+    index_path = os.path.join(cache_dir, 'sheets.json')
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        sheets = {}
+        for sheet in index:
+            table = feather.read_table(os.path.join(cache_dir, sheet['file']))
+            sheets[sheet['name']] = table_to_sheet(table, sheet['columns'])
+        print(f'loaded {len(sheets)} sheets from cache {cache_dir} ({time.perf_counter() - start:.2f}s)')
+        return sheets, cache_dir
+
+    sheets = pd.read_excel(workbook_path, sheet_name=None, header=None)
+    print(f'parsed workbook {workbook_path} ({time.perf_counter() - start:.2f}s)')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        index = []
+        for n, (name, df) in enumerate(sheets.items()):
+            table, layout = sheet_to_table(df)
+            filename = f'{n:02d}.arrow'
+            feather.write_feather(table, os.path.join(cache_dir, filename))
+            index.append({'name': name, 'file': filename, 'columns': layout})
+        # index written last: a cache dir without sheets.json is incomplete
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f, ensure_ascii=False, default=str)
+        os.replace(index_path + '.tmp', index_path)
+        with open(os.path.join(SHEET_CACHE_DIR, 'latest.json'), 'w') as f:
+            json.dump({'sha256': os.path.basename(cache_dir), 'workbook': os.path.basename(workbook_path)}, f)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        print('>>>>>>>>>> sheet cache not written', e)
+    return sheets, cache_dir
+
+
+# cache_dir also holds the typed per-target files of the streaming training path
+excel_df, dataset_cache_dir = read_workbook(workbook_path)
 
 list_sheet = list(excel_df.keys())
 print(list_sheet)
@@ -39,39 +183,116 @@ df_for_st['Value_Clean'] = df_for_st['Value'].apply(
 dict_st = df_for_st.set_index('field name')['Value_Clean'].to_dict()
 print(dict_st)
 
+# numeric range of lv_ fields: "min - max" in column "Value" when the data dic has one,
+# else non-negative (ages, body measures and lab values)
+def parse_range(value):
+    match = re.fullmatch(r'\s*(-?\d+(?:\.\d+)?)\s*-\s*(-?\d+(?:\.\d+)?)\s*', str(value))
+    if match is None:
+        return [0.0, None]
+    return [float(match.group(1)), float(match.group(2))]
+
+dict_range = {
+    field: parse_range(value)
+    for field, value in df_for_st.set_index('field name')['Value'].items()
+    if isinstance(field, str) and field.startswith('lv_')
+}
+
 
 
+def frame_mb(df):
+    return df.memory_usage(index=True, deep=True).sum() / 2**20
+
+def array_mb(a):
+    # dense ndarray or scipy sparse matrix (ColumnTransformer output)
+    if hasattr(a, 'indptr'):
+        return (a.data.nbytes + a.indices.nbytes + a.indptr.nbytes) / 2**20
+    return np.asarray(a).nbytes / 2**20
+
+def prepare_frame(df, label_cols):
+    # typed once at ingest: lv_ -> float64, st_ -> category, label columns as they are,
+    # other columns dropped. The targets of a sheet share this one frame; training
+    # selects and splits its columns per target (memory per stage in df_timing).
+    # lv_ stays float64: the app scales float64 inputs, and float32-rounded training
+    # values (27.32 -> 27.319999) put discrete values on the other side of a split.
+    columns = {}
+    for c in df.columns:
+        if c.startswith("lv_"):
+            columns[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+        elif c.startswith("st_"):
+            columns[c] = df[c].astype("category")
+        elif c in label_cols:
+            columns[c] = df[c]
+    return pd.DataFrame(columns)
+
+def validate_frame(df_raw, df_typed, label_cols):
+    # one vectorized pass per sheet: unknown st_ categories (isin the data dic),
+    # null rates, non-numeric and out-of-range lv_ values
+    columns = {}
+    for c in df_typed.columns:
+        col = df_typed[c]
+        report = {'null_rate': float(col.isna().mean())}
+        if c.startswith("st_"):
+            report['in_data_dic'] = c in dict_st
+            unknown = col[col.notna() & ~col.isin(dict_st.get(c, []))]
+            report['unknown_count'] = int(len(unknown))
+            report['unknown_values'] = {str(v): int(n) for v, n in unknown.value_counts().items() if n > 0}
+        elif c.startswith("lv_"):
+            low, high = dict_range.get(c, [0.0, None])
+            report['range'] = [low, high]
+            report['non_numeric_count'] = int((df_raw[c].notna() & col.isna()).sum())
+            report['below_range'] = int((col < low).sum())
+            report['above_range'] = 0 if high is None else int((col > high).sum())
+        elif c in label_cols:
+            report['classes'] = int(col.nunique())
+        columns[c] = report
+    return {'rows': len(df_typed), 'columns': columns}
+
+# label columns per sheet: one typed frame serves every target of the sheet
+sheet_labels = {}
+for key, sh in target_dataframes.items():
+    sheet_labels.setdefault(sh, []).append(key.split(' $ ')[1])
+
 all_data = {}
+typed_sheets = {}
+df_memory = []
+validation = {}
 for key in target_dataframes:
     sh = target_dataframes[key]
     sp = key.split(' $ ')
     label_col = sp[1]
     print()
     print( '*** check sheet', sh )
-    df = excel_df[sh].copy()
+    df = excel_df[sh]
 
     column_st = df.loc[1]
     df = df.iloc[3:]
     df.columns = column_st
-    all_data[key] = df.copy()
+    if sh not in typed_sheets:
+        typed_sheets[sh] = prepare_frame(df, sheet_labels[sh])
+        df_memory.append({'sheet': sh, 'raw MB': frame_mb(df), 'typed MB': frame_mb(typed_sheets[sh])})
+        validation[sh] = validate_frame(df, typed_sheets[sh], sheet_labels[sh])
+    validation[sh].setdefault('targets', []).append(key)
+    all_data[key] = typed_sheets[sh]
     if( label_col not in df.columns ):
       print('>>>>>>>>>> label_col error', df.columns)
 
-    # filter column start with st_
-    column_st = [c for c in column_st if c.startswith('st_')]
-    # unique value of column_st
-    unique_values = df[column_st].apply(lambda x: x.unique())
-
-    for col, uq_val in unique_values.items():
-        print('check col', col)
-        for uq in uq_val:
-          if( uq not in dict_st[col] and uq is not np.nan ):
-            print('------ value not found in ST sheet', col, uq)
+# data dic check: one row per column with a problem
+df_validation = pd.DataFrame([
+    {'sheet': sh, 'column': c} | report
+    for sh, sheet_report in validation.items()
+    for c, report in sheet_report['columns'].items()
+    if report.get('unknown_count') or report.get('non_numeric_count')
+    or report.get('below_range') or report.get('above_range') or not report.get('in_data_dic', True)
+])
+print('------ data dic check', 'OK' if df_validation.empty else '')
+if not df_validation.empty:
+    print(df_validation)
 
 list_features = {}
 for key in target_dataframes:
   list_features[key] = [c for c in all_data[key].columns if c.startswith("lv_") or c.startswith("st_")]
 print(list_features)
+print(pd.DataFrame(df_memory))
 # -------------------------- end checking
 
 
@@ -95,27 +316,242 @@ import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler, OneHotEncoder, LabelEncoder
 from sklearn.compose import ColumnTransformer
+from sklearn.frozen import FrozenEstimator
 from sklearn.pipeline import Pipeline
 from xgboost import XGBClassifier
+import xgboost
+import tempfile
 from imblearn.over_sampling import RandomOverSampler
 from imblearn.pipeline import Pipeline as ImbPipeline
 
 from sklearn.preprocessing import label_binarize
-from sklearn.model_selection import train_test_split
+from sklearn.utils.class_weight import compute_sample_weight
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
 
 
+def build_preprocessor(columns):
+    lv_cols = [c for c in columns if c.startswith("lv_")]
+    st_cols = [c for c in columns if c.startswith("st_")]
+    return ColumnTransformer(
+        transformers=[
+            ("scale_lv", StandardScaler(), lv_cols),
+            ("encode_st", OneHotEncoder(handle_unknown="ignore"), st_cols)
+        ],
+        remainder="drop"
+    )
+
+
+# XGBoost settings of every target (num_class / n_jobs are set per fit)
+XGB_PARAMS = {
+    "objective": "multi:softmax",
+    "eval_metric": "mlogloss",
+    "random_state": 42,
+}
+
+# class balancing per target:
+# 'weight': "balanced" per-sample weights passed to XGBoost (no duplicated rows)
+# 'oversample': RandomOverSampler in an imblearn pipeline
+BALANCING = {k: 'weight' for k in target_dataframes}
+
+
+# -----------------------------
+# Out-of-core training: targets with at least STREAM_MIN_ROWS rows are written
+# once to a typed Arrow file (record batches of STREAM_CHUNK_ROWS) and trained
+# chunk by chunk through an XGBoost external-memory DataIter, so the frame is
+# never copied whole and XGBoost keeps its pages in a disk cache.
+# -----------------------------
+STREAM_MIN_ROWS = 1_000_000
+STREAM_CHUNK_ROWS = 100_000
+STREAM_REFERENCE_ROWS = 100_000 # rows kept for original_{key}.csv and the checks
+TARGET_DATASET_FORMAT = 1 # bump when write_target_dataset writes a different file
+
+def target_dataset_path(cache_dir, k, df):
+    # named by the target and a hash of what goes into the file, so a changed
+    # sheet, label, frame or file format never reuses an old one
+    label = k.split(' $ ')[1]
+    digest = joblib.hash({
+        'sheet': target_dataframes[k],
+        'label': label,
+        'data': df,
+        'chunk_rows': STREAM_CHUNK_ROWS,
+        'format': TARGET_DATASET_FORMAT,
+    })
+    return os.path.join(cache_dir, f"target_{re.sub(r'[^0-9A-Za-z]+', '_', k)}_{digest}.arrow")
+
+def write_target_dataset(df, label_col, file_path):
+    # lv_ -> float64, st_ -> string, label -> int64 when numeric else string
+    columns = {}
+    for c in df.columns:
+        if c.startswith("lv_"):
+            columns[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+        elif c.startswith("st_"):
+            columns[c] = df[c].map(str, na_action="ignore").astype(object)
+    label = pd.to_numeric(df[label_col], errors="coerce")
+    if label.notna().all() and (label == label.round()).all():
+        columns['label'] = label.astype("int64")
+    else:
+        columns['label'] = df[label_col].map(str, na_action="ignore").astype(object)
+    table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index=False)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with pa.OSFile(file_path + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=STREAM_CHUNK_ROWS)
+    os.replace(file_path + '.tmp', file_path)
+
+def iter_chunks(file_path):
+    # memory-mapped, one record batch at a time; missing st_ values as nan like read_excel
+    with pa.memory_map(file_path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            chunk = reader.get_batch(i).to_pandas()
+            for c in chunk.columns:
+                if c.startswith("st_"):
+                    chunk[c] = chunk[c].where(chunk[c].notna(), np.nan)
+            yield chunk
+
+def chunk_test_mask(n, rows, test_size, random_state):
+    # same rows go to test in every pass
+    return np.random.default_rng([random_state, n]).random(rows) < test_size
+
+
+class ArrowChunkIter(xgboost.DataIter):
+    # training rows of each chunk -> preprocessor -> XGBoost external memory
+    def __init__(self, file_path, preprocessor, le, class_weights, test_size, random_state, cache_prefix):
+        self.file_path = file_path
+        self.preprocessor = preprocessor
+        self.le = le
+        self.class_weights = class_weights
+        self.test_size = test_size
+        self.random_state = random_state
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        self._chunks = None
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = enumerate(iter_chunks(self.file_path))
+        for n, chunk in self._chunks:
+            chunk = chunk[~chunk_test_mask(n, len(chunk), self.test_size, self.random_state)]
+            if len(chunk) == 0:
+                continue
+            y = self.le.transform(chunk['label'])
+            weight = None if self.class_weights is None else self.class_weights[y]
+            input_data(data=self.preprocessor.transform(chunk), label=y, weight=weight)
+            return True
+        return False
+
+
+def train_streaming(file_path, label_col="label", test_size=0.2, random_state=42, preprocessor=None, n_jobs=None, balancing="weight"):
+    # same result as train_and_predict_balanced (pipeline, le, scores, reference frame,
+    # memory per stage) without holding the target in memory; label_col is already
+    # 'label' in the file
+    if balancing != "weight":
+        raise ValueError(f"Streaming training supports balancing='weight' only, not {balancing}")
+
+    # --- Pass 1: scaler statistics, categories, labels, reference sample
+    with pa.memory_map(file_path) as source:
+        reader = pa.ipc.open_file(source)
+        schema = reader.schema
+        n_total = sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    reference_frac = min(1.0, STREAM_REFERENCE_ROWS / max(n_total, 1))
+    features = [c for c in schema.names if c.startswith("lv_") or c.startswith("st_")]
+    lv_cols = [c for c in features if c.startswith("lv_")]
+    st_cols = [c for c in features if c.startswith("st_")]
+    scaler = StandardScaler()
+    categories = {c: set() for c in st_cols}
+    has_nan = {c: False for c in st_cols}
+    train_counts = {}
+    all_labels = set()
+    reference = []
+    for n, chunk in enumerate(iter_chunks(file_path)):
+        train = chunk[~chunk_test_mask(n, len(chunk), test_size, random_state)]
+        if preprocessor is None and lv_cols and len(train):
+            scaler.partial_fit(train[lv_cols])
+        for c in st_cols:
+            categories[c].update(train[c].dropna().unique())
+            has_nan[c] = has_nan[c] or bool(train[c].isna().any())
+        for value, count in train['label'].value_counts().items():
+            train_counts[value] = train_counts.get(value, 0) + count
+        all_labels.update(chunk['label'].unique())
+        reference.append(chunk.sample(frac=reference_frac, random_state=random_state))
+    df_reference = pd.concat(reference, ignore_index=True)
+
+    le = LabelEncoder()
+    le.fit(sorted(all_labels))
+
+    if preprocessor is None:
+        # fit the ColumnTransformer on one row per category so OneHotEncoder sees every
+        # category, then swap in the scaler fitted over all chunks
+        n_rows = max([len(v) + has_nan[c] for c, v in categories.items()] + [1])
+        frame = {c: np.zeros(n_rows) for c in lv_cols}
+        for c in st_cols:
+            values = sorted(categories[c]) + ([np.nan] if has_nan[c] else [])
+            frame[c] = (values * n_rows)[:n_rows] if values else [np.nan] * n_rows
+        preprocessor = build_preprocessor(features).fit(pd.DataFrame(frame)[features])
+        if lv_cols:
+            preprocessor.transformers_ = [
+                (name, scaler if name == "scale_lv" else transformer, columns)
+                for name, transformer, columns in preprocessor.transformers_
+            ]
+
+    # "balanced" weights, as compute_sample_weight does for the in-memory path
+    counts = np.array([train_counts.get(c, 0) for c in le.classes_], dtype=float)
+    class_weights = np.where(counts > 0, counts.sum() / (len(counts) * np.maximum(counts, 1)), 0.0)
+
+    # --- Pass 2: train on an external-memory DMatrix
+    num_class = len(le.classes_)
+    params = {k: v for k, v in XGB_PARAMS.items() if k != "random_state"}
+    params = params | {"seed": XGB_PARAMS["random_state"], "num_class": num_class, "tree_method": "hist"}
+    if n_jobs is not None:
+        params["nthread"] = n_jobs
+    with tempfile.TemporaryDirectory() as cache_dir:
+        it = ArrowChunkIter(file_path, preprocessor, le, class_weights, test_size, random_state,
+                            os.path.join(cache_dir, 'xgb'))
+        dtrain = xgboost.ExtMemQuantileDMatrix(it)
+        booster = xgboost.train(params, dtrain, num_boost_round=XGBClassifier().get_num_boosting_rounds())
+        del dtrain
+
+    model = XGBClassifier()
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    pipeline = Pipeline([("preprocessor", preprocessor), ("model", model)])
+
+    # --- Pass 3: scores on the test rows
+    y_test, y_pred = [], []
+    for n, chunk in enumerate(iter_chunks(file_path)):
+        test = chunk[chunk_test_mask(n, len(chunk), test_size, random_state)]
+        if len(test):
+            y_test.append(le.transform(test['label']))
+            y_pred.append(pipeline.predict(test[features]))
+    y_test = np.concatenate(y_test)
+    y_pred = np.concatenate(y_pred)
+    scores = {
+        "Accuracy": accuracy_score(y_test, y_pred),
+        "Precision": precision_score(y_test, y_pred, average="weighted"),
+        "Recall": recall_score(y_test, y_pred, average="weighted"),
+        "F1-Score": f1_score(y_test, y_pred, average="weighted"),
+    }
+    df_reference = df_reference[features + ['label']]
+    # only the reference sample is held whole, the rest goes chunk by chunk
+    memory = {'train frame MB': frame_mb(df_reference)}
+    return pipeline, le, scores, df_reference, memory
+
+
 # -----------------------------
 # Function for Training + Predict with balancing
+# preprocessor: already fitted ColumnTransformer shared with other targets (kept as is)
+# n_jobs: XGBoost threads for this fit (None = XGBoost default)
+# balancing: 'weight' or 'oversample', see BALANCING
 # -----------------------------
-def train_and_predict_balanced(df, label_col="label", test_size=0.2, random_state=42):
-    # --- Select columns
-    _df_train = df.copy()
-    _df_train = _df_train[[c for c in df.columns if c.startswith("lv_") or c.startswith("st_")] + [label_col]].copy()
-    _df_train.columns = [c for c in df.columns if c.startswith("lv_") or c.startswith("st_")] + ['label']
-    
-    X = _df_train.drop('label', axis=1).copy()
-    y = _df_train['label'].copy()
+def train_and_predict_balanced(df, label_col="label", test_size=0.2, random_state=42, preprocessor=None, n_jobs=None, balancing="weight"):
+    # --- Select columns (df is already typed by prepare_frame; selecting the
+    # feature columns, the train frame and the split each copy, see memory)
+    feature_cols = [c for c in df.columns if c.startswith("lv_") or c.startswith("st_")]
+    X = df[feature_cols]
+    y = df[label_col]
+    _df_train = pd.concat([X, y.rename('label')], axis=1, copy=False)
 
     # --- Encode label
     le = LabelEncoder()
@@ -126,37 +562,43 @@ def train_and_predict_balanced(df, label_col="label", test_size=0.2, random_stat
         X, y_enc, test_size=test_size, random_state=random_state, stratify=y_enc
     )
 
-    # --- Separate columns
-    lv_cols = [c for c in X.columns if c.startswith("lv_")]
-    st_cols = [c for c in X.columns if c.startswith("st_")]
-
     # --- Preprocessing
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("scale_lv", StandardScaler(), lv_cols),
-            ("encode_st", OneHotEncoder(handle_unknown="ignore"), st_cols)
-        ],
-        remainder="drop"
-    )
-
-    # --- Oversampler
-    ros = RandomOverSampler(random_state=42)
+    if preprocessor is None:
+        preprocessor_step = build_preprocessor(X.columns)
+    else:
+        preprocessor_step = FrozenEstimator(preprocessor)
 
     # --- Pipeline with imbalance handling
     num_class = len(np.unique(y_enc))
-    pipeline = ImbPipeline([
-        ("preprocessor", preprocessor),
-        ("oversample", ros),
-        ("model", XGBClassifier(
-            objective="multi:softmax",
-            eval_metric="mlogloss",
-            num_class=num_class,
-            random_state=42
-        ))
-    ])
+    model = XGBClassifier(
+        **XGB_PARAMS,
+        num_class=num_class,
+        n_jobs=n_jobs
+    )
+    if balancing == "oversample":
+        # --- Oversampler
+        ros = RandomOverSampler(random_state=42)
+        pipeline = ImbPipeline([
+            ("preprocessor", preprocessor_step),
+            ("oversample", ros),
+            ("model", model)
+        ])
+        fit_params = {}
+    elif balancing == "weight":
+        # rare classes weigh more instead of being copied
+        pipeline = Pipeline([
+            ("preprocessor", preprocessor_step),
+            ("model", model)
+        ])
+        fit_params = {"model__sample_weight": compute_sample_weight("balanced", y_train)}
+    else:
+        raise ValueError(f"Unknown balancing mode: {balancing}")
 
     # --- Train
-    pipeline.fit(X_train, y_train)
+    pipeline.fit(X_train, y_train, **fit_params)
+    if preprocessor is not None:
+        # unwrap so the saved pipeline holds the plain (shared) ColumnTransformer
+        pipeline.steps[0] = ("preprocessor", preprocessor)
 
     # --- Predict
     y_pred = pipeline.predict(X_test)  # array([1])
@@ -183,78 +625,504 @@ def train_and_predict_balanced(df, label_col="label", test_size=0.2, random_stat
         # "AUC-Score": auc
     }
 
+    # --- Memory per stage (MB)
+    memory = {
+        'features MB': frame_mb(X),
+        'train frame MB': frame_mb(_df_train),
+        'split MB': frame_mb(X_train) + frame_mb(X_test),
+        'transformed MB': array_mb(pipeline.named_steps['preprocessor'].transform(X_train)),
+    }
+
     # --- Return pipeline + label encoder
-    return pipeline, le, scores, _df_train
+    return pipeline, le, scores, _df_train, memory
 
 
 import joblib
+from joblib import Parallel, delayed, parallel_config
+from joblib.externals.loky import ProcessPoolExecutor
+import sklearn
+try:
+    import resource # peak RSS for the balancing benchmark (not on Windows)
+except ImportError:
+    resource = None
 import os # For managing file paths
+import io
+import time
+import shutil
+from datetime import datetime
 
+from myclass import MyModel, MyReferenceStore, MyOnnxPipeline
 
-def save_pipeline(pipeline, file_path):
-    with open(file_path, 'wb') as file:
-        joblib.dump(pipeline, file)
 
-def save_le(le, file_path):
+def save_bundle(bundle, file_path):
+    # uncompressed so the app can joblib.load(..., mmap_mode='r')
     with open(file_path, 'wb') as file:
-        joblib.dump(le, file)
-
-
+        joblib.dump(bundle, file, compress=0)
+
+def write_manifest(version_dir, version):
+    # written last: a version dir without manifest.json is incomplete
+    files = {}
+    for filename in sorted(os.listdir(version_dir)):
+        if filename.endswith(MyModel.UNVERIFIED_EXTENSIONS):
+            continue
+        file_path = os.path.join(version_dir, filename)
+        files[filename] = {
+            'size': os.path.getsize(file_path),
+            'sha256': MyModel.file_checksum(file_path),
+        }
+    manifest = {
+        'version': version,
+        'format': MyModel.BUNDLE_FORMAT,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'files': files,
+    }
+    with open(os.path.join(version_dir, MyModel.MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def prune_versions(model_dir, keep):
+    # keep the newest `keep` complete version dirs (names sort by time) and the
+    # published one; older dirs without manifest.json are left by failed runs
+    # (a newer one may be another run still training)
+    versions_dir = os.path.join(model_dir, MyModel.VERSIONS_DIRNAME)
+    with open(os.path.join(model_dir, MyModel.CURRENT_FILENAME), 'r') as f:
+        current = json.load(f)['version']
+    complete = []
+    for version in sorted(os.listdir(versions_dir), reverse=True):
+        if os.path.exists(os.path.join(versions_dir, version, MyModel.MANIFEST_FILENAME)):
+            complete.append(version)
+        elif version < current:
+            shutil.rmtree(os.path.join(versions_dir, version))
+            print('removed incomplete model version', version)
+    for version in complete[keep:]:
+        if version != current:
+            shutil.rmtree(os.path.join(versions_dir, version))
+            print('removed old model version', version)
+
+def train_target(k, df, preprocessor, n_jobs):
+    # one target in a worker process, returns train_and_predict_balanced + fit seconds
+    # df is None for streamed targets (read from target_files[k] instead)
+    start = time.perf_counter()
+    label = k.split(' $ ')[1]
+    if df is None:
+        result = train_streaming(target_files[k], label, preprocessor=preprocessor, n_jobs=n_jobs, balancing=BALANCING[k])
+    else:
+        result = train_and_predict_balanced(df, label, preprocessor=preprocessor, n_jobs=n_jobs, balancing=BALANCING[k])
+    return result + (time.perf_counter() - start,)
+
+def benchmark_balancing(k, df, preprocessor, balancing, n_jobs):
+    # runs in its own fresh process (see run_fresh): ru_maxrss is this fit's peak
+    rss_scale = 1 if sys.platform == 'darwin' else 1024 # bytes on macOS, KB on Linux
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale
+    start = time.perf_counter()
+    label = k.split(' $ ')[1]
+    _, _, scores, _, _ = train_and_predict_balanced(df, label, preprocessor=preprocessor, n_jobs=n_jobs, balancing=balancing)
+    seconds = time.perf_counter() - start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale
+    return {
+        'key $ label': k,
+        'balancing': balancing,
+        'fit s': seconds,
+        'peak RSS MB': rss_peak / 2**20,
+        'RSS growth MB': (rss_peak - rss_before) / 2**20,
+    } | scores
+
+def run_fresh(func, *args):
+    # one short-lived worker process per call
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(func, *args).result()
 
-# absolute path
-model_dir = os.path.join(os.path.dirname(__file__), 'Models')
+# -----------------------------
+# Evaluation: stratified k-fold CV and bootstrap confidence intervals
+# -----------------------------
+N_FOLDS = 5
+N_BOOTSTRAP = 200
+
+def evaluation_matrix(k, preprocessor):
+    # preprocessing is unsupervised: transform the target once with the fitted
+    # preprocessor of its trained pipeline and reuse the matrix in every fold
+    label = k.split(' $ ')[1]
+    X = all_data[k][list_features[k]]
+    y = LabelEncoder().fit_transform(all_data[k][label])
+    return preprocessor.transform(X), y
+
+def fit_fold(Xt, y, train_index, test_index, balancing):
+    # one fold in a worker process: probabilities for the held-out rows
+    X_train, y_train = Xt[train_index], y[train_index]
+    sample_weight = None
+    if balancing == "oversample":
+        X_train, y_train = RandomOverSampler(random_state=42).fit_resample(X_train, y_train)
+    else:
+        sample_weight = compute_sample_weight("balanced", y_train)
+    model = XGBClassifier(**XGB_PARAMS, num_class=len(np.unique(y)), n_jobs=1)
+    model.fit(X_train, y_train, sample_weight=sample_weight)
+    return model.predict_proba(Xt[test_index])
+
+def classification_scores(y, y_prob):
+    y_pred = y_prob.argmax(axis=1)
+    try:
+        if y_prob.shape[1] == 2:
+            auc = roc_auc_score(y, y_prob[:, 1])
+        else:
+            auc = roc_auc_score(y, y_prob, multi_class="ovr", average="weighted", labels=np.arange(y_prob.shape[1]))
+    except ValueError:
+        # a resample without every class
+        auc = np.nan
+    return {
+        "Accuracy": accuracy_score(y, y_pred),
+        "F1-Score": f1_score(y, y_pred, average="weighted"),
+        "AUC-Score": auc,
+    }
 
-# delete all file in Models
-for filename in os.listdir(model_dir):
-    os.remove(os.path.join(model_dir, filename))
+def bootstrap_scores(y, y_prob, n_bootstrap, random_state=42):
+    # 95% percentile intervals over resamples of the out-of-fold predictions
+    rng = np.random.default_rng(random_state)
+    samples = []
+    for _ in range(n_bootstrap):
+        index = rng.integers(0, len(y), len(y))
+        samples.append(classification_scores(y[index], y_prob[index]))
+    estimate = classification_scores(y, y_prob)
+    return {
+        metric: {
+            'estimate': float(estimate[metric]),
+            'low': float(np.nanpercentile([sample[metric] for sample in samples], 2.5)),
+            'high': float(np.nanpercentile([sample[metric] for sample in samples], 97.5)),
+        }
+        for metric in estimate
+    }
 
+def evaluate_targets(preprocessors, n_jobs):
+    # preprocessors: key -> fitted preprocessor of the trained pipeline
+    # every fold of every target is one task on the process pool, then the bootstraps
+    keys = list(preprocessors)
+    matrices = {k: evaluation_matrix(k, preprocessors[k]) for k in keys}
+    folds = StratifiedKFold(n_splits=N_FOLDS, shuffle=True, random_state=42)
+    tasks = [
+        (k, train_index, test_index)
+        for k in keys
+        for train_index, test_index in folds.split(np.zeros(len(matrices[k][1])), matrices[k][1])
+    ]
+    fold_probs = Parallel(n_jobs=n_jobs)(
+        delayed(fit_fold)(*matrices[k], train_index, test_index, BALANCING[k])
+        for k, train_index, test_index in tasks
+    )
 
+    out_of_fold = {k: np.zeros((len(matrices[k][1]), len(np.unique(matrices[k][1])))) for k in keys}
+    fold_scores = {k: [] for k in keys}
+    for (k, _, test_index), y_prob in zip(tasks, fold_probs):
+        out_of_fold[k][test_index] = y_prob
+        fold_scores[k].append(classification_scores(matrices[k][1][test_index], y_prob))
 
+    bootstraps = Parallel(n_jobs=n_jobs)(
+        delayed(bootstrap_scores)(matrices[k][1], out_of_fold[k], N_BOOTSTRAP) for k in keys
+    )
+    results = {}
+    for k, bootstrap in zip(keys, bootstraps):
+        df_folds = pd.DataFrame(fold_scores[k])
+        results[k] = {
+            'folds': N_FOLDS,
+            'cv': {
+                metric: {'mean': float(df_folds[metric].mean()), 'std': float(df_folds[metric].std()),
+                         'per_fold': [float(v) for v in df_folds[metric]]}
+                for metric in df_folds.columns
+            },
+            'bootstrap': bootstrap,
+        }
+    return results
+
+def json_safe(value):
+    # NaN (e.g. AUC of a resample without every class) is written as null
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def target_fingerprint(k):
+    # same data, features, settings and libraries -> same model
+    label = k.split(' $ ')[1]
+    return joblib.hash({
+        'data': all_data[k][list_features[k] + [label]],
+        'features': list_features[k],
+        'xgb': XGB_PARAMS,
+        'balancing': BALANCING[k],
+        'streaming': k in target_files,
+        'shared_preprocessor': k in shared_preprocessors,
+        'libraries': (sklearn.__version__, xgboost.__version__),
+        'format': MyModel.BUNDLE_FORMAT,
+    })
+
+def load_published(model_dir):
+    # {key: model entry, reference stats and dir} of the published version
+    current_path = os.path.join(model_dir, MyModel.CURRENT_FILENAME)
+    if not os.path.exists(current_path):
+        return {}
+    with open(current_path, 'r') as f:
+        published_dir = os.path.join(model_dir, MyModel.VERSIONS_DIRNAME, json.load(f)['version'])
+    bundle = joblib.load(os.path.join(published_dir, MyModel.BUNDLE_FILENAME))
+    if bundle.get('format') != MyModel.BUNDLE_FORMAT:
+        return {}
+    return {
+        k: {'model': model, 'stats': bundle['reference_stats'][k], 'dir': published_dir}
+        for k, model in bundle['models'].items()
+        if 'fingerprint' in model
+    }
 
-file_path = os.path.join(model_dir, 'list_features.json')
-with open(file_path, 'w') as f:
-    json.dump(list_features, f, indent=4)
+def measure_latency(predictor, X, n=200):
+    # mean single-row predict_proba latency in ms
+    predictor.predict_proba(X)
+    start = time.perf_counter()
+    for _ in range(n):
+        predictor.predict_proba(X)
+    return (time.perf_counter() - start) / n * 1000
 
-print(f"'list_features' saved to {file_path}")
+def measure_artifact(obj):
+    # size and load time of obj as a joblib file
+    buffer = io.BytesIO()
+    joblib.dump(obj, buffer, compress=0)
+    size = buffer.tell()
+    buffer.seek(0)
+    start = time.perf_counter()
+    joblib.load(buffer)
+    return size, time.perf_counter() - start
 
 
 
+# absolute path
+model_dir = os.path.join(os.path.dirname(__file__), 'Models')
 
+# every run writes a fresh Models/versions/<version> dir; the app keeps serving
+# the published version until current.json is flipped at the end
+KEEP_VERSIONS = 3 # version dirs kept for rollback: MyModel.publish(model_dir, version)
+# a run started in the same second as another gets a -1, -2, ... suffix
+run_started = datetime.now().strftime('%Y%m%d-%H%M%S')
+version, n_collisions = run_started, 0
+while True:
+    version_dir = os.path.join(model_dir, MyModel.VERSIONS_DIRNAME, version)
+    try:
+        os.makedirs(version_dir, exist_ok=False)
+        break
+    except FileExistsError:
+        n_collisions += 1
+        version = f'{run_started}-{n_collisions}'
+
+# data dic validation of this run's inputs, saved with the model artifacts
+column_reports = [r for sheet_report in validation.values() for r in sheet_report['columns'].values()]
+validation_report = {
+    'version': version,
+    'workbook_sha256': os.path.basename(dataset_cache_dir),
+    'unknown_categories': sum(r.get('unknown_count', 0) for r in column_reports),
+    'non_numeric_values': sum(r.get('non_numeric_count', 0) for r in column_reports),
+    'range_violations': sum(r.get('below_range', 0) + r.get('above_range', 0) for r in column_reports),
+    'sheets': validation,
+}
+with open(os.path.join(version_dir, 'validation_report.json'), 'w') as f:
+    json.dump(validation_report, f, indent=2, ensure_ascii=False)
 
 
 
 
 all_pipelines = {}
+all_stats = {}
+df_timing = []
 df_score = []
+df_artifact = []
+df_backend = []
+# targets from the same sheet with the same features (Kidney Label1/Label2) share
+# one preprocessor fitted on the whole sheet, so the app transforms once for both.
+# scaling / one-hot are unsupervised and the trees do not depend on the scale.
+feature_groups = {}
+for k in all_data:
+    feature_groups.setdefault((target_dataframes[k], tuple(list_features[k])), []).append(k)
+
+shared_preprocessors = {}
+for (sh, features), keys in feature_groups.items():
+    if len(keys) > 1:
+        preprocessor = build_preprocessor(features).fit(all_data[keys[0]][list(features)])
+        for k in keys:
+            shared_preprocessors[k] = preprocessor
+        print('shared preprocessor', keys)
+
+# large targets are trained out of core from a typed Arrow file next to the sheet cache
+target_files = {}
+for k in all_data:
+    if len(all_data[k]) >= STREAM_MIN_ROWS:
+        target_files[k] = target_dataset_path(dataset_cache_dir, k, all_data[k])
+        if not os.path.exists(target_files[k]):
+            # files of this target written from other data are stale
+            prefix = os.path.basename(target_files[k]).rsplit('_', 1)[0]
+            for filename in os.listdir(dataset_cache_dir):
+                if re.fullmatch(re.escape(prefix) + r'_[0-9a-f]{32}\.arrow', filename):
+                    os.remove(os.path.join(dataset_cache_dir, filename))
+            write_target_dataset(all_data[k], k.split(' $ ')[1], target_files[k])
+        print('streaming training', k, target_files[k])
+
+# incremental: targets whose fingerprint matches the published model are not
+# trained again, their artifacts are carried forward into the new version
+RETRAIN_ALL = False
+fingerprints = {k: target_fingerprint(k) for k in all_data}
+published = {} if RETRAIN_ALL else load_published(model_dir)
+keys_to_train = [k for k in all_data if published.get(k, {}).get('model', {}).get('fingerprint') != fingerprints[k]]
+print('unchanged targets', [k for k in all_data if k not in keys_to_train])
+
+# train every target at once: one process per target within CPU_BUDGET cores,
+# the cores split evenly between the concurrent XGBoost fits
+CPU_BUDGET = os.cpu_count() or 1
+n_processes = max(1, min(len(keys_to_train), CPU_BUDGET))
+n_threads = max(1, CPU_BUDGET // n_processes)
+print(f'training {len(keys_to_train)} targets: {n_processes} processes x {n_threads} threads')
+
+start = time.perf_counter()
+with parallel_config(backend='loky', inner_max_num_threads=n_threads):
+    trained = Parallel(n_jobs=n_processes)(
+        delayed(train_target)(k, None if k in target_files else all_data[k], shared_preprocessors.get(k), n_threads)
+        for k in keys_to_train
+    )
+train_seconds = time.perf_counter() - start
+trained = dict(zip(keys_to_train, trained))
+
+# k-fold CV + bootstrap CIs of the retrained targets (streamed ones are too big to fold in memory)
+EVALUATE = True
+evaluations = {}
+if EVALUATE:
+    start = time.perf_counter()
+    evaluations = evaluate_targets(
+        {k: trained[k][0].named_steps['preprocessor'] for k in keys_to_train if k not in target_files},
+        CPU_BUDGET,
+    )
+    print(f'evaluation: {len(evaluations)} targets x {N_FOLDS} folds, {N_BOOTSTRAP} bootstraps ({time.perf_counter() - start:.1f}s)')
+
 for i, k in enumerate(all_data):
     # if i == 1:
     #   continue
-    sp = k.split(' $ ')
-    label = sp[1]
     print(i, k)
 
-    df = all_data[k].copy()
-    
-    print(df.columns)
-    pipeline, le, score, df_train = train_and_predict_balanced(df, label)
-    all_pipelines[k] = {
-        'pipeline': pipeline,
-        'le': le,
-    }
-
-    csv_path = os.path.join(model_dir, f"original_{k}.csv")
+    if k not in trained:
+        carried = published[k]
+        all_pipelines[k] = carried['model']
+        all_stats[k] = carried['stats']
+        for ext in ('csv', 'arrow'):
+            file_path = os.path.join(carried['dir'], f"original_{k}.{ext}")
+            if os.path.exists(file_path):
+                shutil.copy2(file_path, version_dir)
+        print('unchanged, carried forward from', carried['model']['trained_version'])
+        df_score.append({'key $ label': k} | carried['model']['scores'] | {'trained': carried['model']['trained_version']})
+        continue
+
+    pipeline, le, score, df_train, memory, fit_seconds = trained[k]
+    df_timing.append({'key $ label': k, 'fit s': fit_seconds} | memory)
+    all_pipelines[k] = MyModel.export_inference_model(pipeline, le)
+    all_pipelines[k]['fingerprint'] = fingerprints[k]
+    all_pipelines[k]['trained_version'] = version
+    all_pipelines[k]['scores'] = score
+    if k in evaluations:
+        all_pipelines[k]['evaluation'] = evaluations[k]
+
+    full_size, full_load = measure_artifact({'pipeline': pipeline, 'le': le})
+    lean_size, lean_load = measure_artifact(all_pipelines[k])
+    df_artifact.append({
+        'key $ label': k,
+        'full KB': full_size / 1024,
+        'lean KB': lean_size / 1024,
+        'full load ms': full_load * 1000,
+        'lean load ms': lean_load * 1000,
+    })
+
+    csv_path = os.path.join(version_dir, f"original_{k}.csv")
     df_train.to_csv(csv_path, index=False)
-
-    filename_prefix = k
-    pipeline_filename = f'{filename_prefix}$$pipeline.joblib'
-    le_filename = f'{filename_prefix}$$le.joblib'
-    save_pipeline(pipeline, os.path.join(model_dir, pipeline_filename))
-    save_le(le, os.path.join(model_dir, le_filename))
+    # columnar copy for MyReferenceStore (memory-mapped by the app)
+    arrow_path = os.path.join(version_dir, f"original_{k}.arrow")
+    df_reference = pd.read_csv(csv_path)
+    df_reference.to_feather(arrow_path, compression='uncompressed')
+    # histograms / category counts / quantiles for the summary charts
+    all_stats[k] = MyReferenceStore.compute_stats(df_reference)
+
+    # the app derives labels from argmax(predict_proba), check it agrees with predict
+    X_ref = df_train.drop('label', axis=1)
+    y_label = le.inverse_transform(pipeline.predict(X_ref))
+    y_argmax = le.inverse_transform(pipeline.predict_proba(X_ref).argmax(axis=1))
+    n_mismatch = int((y_label != y_argmax).sum())
+    if n_mismatch > 0:
+        print('>>>>>>>>>> predict / argmax(predict_proba) mismatch', k, n_mismatch)
+
+    # ONNX backend: parity with pipeline.predict_proba on the reference rows + latency
+    try:
+        all_pipelines[k]['onnx'] = MyOnnxPipeline.export(pipeline)
+    except ValueError as e:
+        print('>>>>>>>>>> ONNX export skipped', k, e)
+    else:
+        onnx_pipeline = MyOnnxPipeline(all_pipelines[k]['onnx'])
+        y_prob = pipeline.predict_proba(X_ref)
+        y_prob_onnx = onnx_pipeline.predict_proba(X_ref)
+        df_backend.append({
+            'key $ label': k,
+            'max |prob diff|': float(np.abs(y_prob - y_prob_onnx).max()),
+            'label match': float((y_prob.argmax(axis=1) == y_prob_onnx.argmax(axis=1)).mean()),
+            'joblib ms/row': measure_latency(pipeline, X_ref.iloc[:1]),
+            'onnx ms/row': measure_latency(onnx_pipeline, X_ref.iloc[:1]),
+        })
 
     data_score = {}
     data_score['key $ label'] = k
     data_score = data_score | score
+    data_score['trained'] = version
     df_score.append(data_score)
 
 
+# one versioned bundle: pipelines + label encoders + list_features + reference stats
+bundle = {
+    'format': MyModel.BUNDLE_FORMAT,
+    'version': version,
+    'list_features': list_features,
+    'models': all_pipelines,
+    'reference_stats': all_stats,
+}
+bundle_path = os.path.join(version_dir, MyModel.BUNDLE_FILENAME)
+save_bundle(bundle, bundle_path)
+print(f"model bundle {bundle['version']} saved to {bundle_path}")
+
+# scores artifact: hold-out scores + CV / bootstrap of every model in this version
+scores_report = {
+    k: {'trained': model['trained_version'], 'holdout': model['scores']} | model.get('evaluation', {})
+    for k, model in all_pipelines.items()
+}
+with open(os.path.join(version_dir, 'scores.json'), 'w') as f:
+    json.dump(json_safe(scores_report), f, indent=2, ensure_ascii=False, allow_nan=False)
+df_evaluation = pd.DataFrame([
+    {'key $ label': k, 'metric': metric, 'cv mean': cv['mean'], 'cv std': cv['std'],
+     'ci low': report['bootstrap'][metric]['low'], 'ci high': report['bootstrap'][metric]['high']}
+    for k, report in scores_report.items() if 'cv' in report
+    for metric, cv in report['cv'].items()
+])
+
+# manifest + checksums, then publish with one atomic rename of current.json
+write_manifest(version_dir, version)
+MyModel.publish(model_dir, version)
+print(f"published model version {version}")
+prune_versions(model_dir, KEEP_VERSIONS)
+
+
+# balancing benchmark (off by default): the retrained targets with both modes,
+# each fit in a fresh process (1 XGBoost thread each) for peak memory, time and
+# weighted scores
+BENCHMARK_BALANCING = False
+df_balancing = []
+if BENCHMARK_BALANCING and resource is None:
+    print('>>>>>>>>>> balancing benchmark skipped, no resource module')
+elif BENCHMARK_BALANCING:
+    df_balancing = Parallel(n_jobs=CPU_BUDGET, backend='threading')(
+        delayed(run_fresh)(benchmark_balancing, k, all_data[k], shared_preprocessors.get(k), balancing, 1)
+        for k in keys_to_train
+        if k not in target_files
+        for balancing in ('weight', 'oversample')
+    )
+
+
+print(pd.DataFrame(df_timing))
+print(f"total training wall-clock: {train_seconds:.1f}s (sum of fits {sum(t['fit s'] for t in df_timing):.1f}s)")
+print(pd.DataFrame(df_artifact))
+print(pd.DataFrame(df_backend))
+print(pd.DataFrame(df_balancing))
+print(df_evaluation)
 print(pd.DataFrame(df_score))
\ No newline at end of file
@@ -0,0 +1,145 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+# the app imports MyPackage from the StreamlitApp dir
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from MyPackage.myclass import MyMicroBatcher, MyModel, MyOnnxPipeline, MyReferenceStore
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '..', 'MyPackage', 'Models')
+MODEL_KEYS = sorted(
+    f.replace('$$pipeline.joblib', '') for f in os.listdir(MODEL_DIR) if f.endswith('$$pipeline.joblib')
+)
+
+
+@pytest.fixture(scope='module')
+def model():
+    return MyModel()
+
+
+def reference_rows(key):
+    df = pd.read_csv(os.path.join(MODEL_DIR, f'original_{key}.csv'))
+    return df.drop(columns='label')
+
+
+@pytest.mark.parametrize('key', MODEL_KEYS)
+def test_batch_predict_matches_pipeline(model, key):
+    X = reference_rows(key)
+    loaded = model._get_loaded_pipeline(model.models, key)
+    expected = loaded['le'].inverse_transform(loaded['pipeline'].predict(X))
+
+    result = model.predict_all_models_batch(X)[key]
+    assert (result['predict'].to_numpy() == expected).all()
+
+
+def rows_with_none(X):
+    # missing fields as the app sends them: None in every other st_ cell
+    X = X.astype({c: object for c in X.columns if c.startswith('st_')})
+    for c in X.columns:
+        if c.startswith('st_'):
+            X.loc[X.index[::2], c] = None
+    return X
+
+
+@pytest.fixture(scope='module')
+def compiled_model():
+    return MyModel(use_compiled=True)
+
+
+@pytest.mark.parametrize('key', MODEL_KEYS)
+def test_compiled_matches_pipeline(compiled_model, key):
+    loaded = compiled_model._get_loaded_pipeline(compiled_model.models, key)
+    assert loaded['compiled'] is not None
+    for X in (reference_rows(key), rows_with_none(reference_rows(key))):
+        expected = loaded['pipeline'].predict_proba(X)
+        np.testing.assert_allclose(loaded['compiled'].predict_proba(X), expected, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('key', MODEL_KEYS)
+def test_onnx_matches_pipeline(model, key):
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('onnxmltools')
+    pipeline = model._get_loaded_pipeline(model.models, key)['pipeline']
+    onnx_pipeline = MyOnnxPipeline(MyOnnxPipeline.export(pipeline))
+    for X in (reference_rows(key), rows_with_none(reference_rows(key))):
+        expected = pipeline.predict_proba(X)
+        np.testing.assert_allclose(onnx_pipeline.predict_proba(X), expected, rtol=0, atol=1e-6)
+
+
+def write_version(model_dir, version, files):
+    # a versions/<version> dir with a manifest, like train_model.write_manifest
+    version_dir = os.path.join(model_dir, MyModel.VERSIONS_DIRNAME, version)
+    os.makedirs(version_dir)
+    manifest = {}
+    for filename, content in files.items():
+        file_path = os.path.join(version_dir, filename)
+        with open(file_path, 'w') as f:
+            f.write(content)
+        manifest[filename] = {'size': os.path.getsize(file_path), 'sha256': MyModel.file_checksum(file_path)}
+    with open(os.path.join(version_dir, MyModel.MANIFEST_FILENAME), 'w') as f:
+        json.dump({'version': version, 'files': manifest}, f)
+    return version_dir
+
+
+def test_published_dir_falls_back_to_a_verified_version(tmp_path):
+    good_dir = write_version(tmp_path, '20260101-000000', {'scores.json': '{}'})
+    # an old manifest listing the git-ignored .arrow, missing from the checkout
+    arrow_dir = write_version(tmp_path, '20260102-000000', {'scores.json': '{}', 'original_x.arrow': 'x'})
+    os.remove(os.path.join(arrow_dir, 'original_x.arrow'))
+    broken_dir = write_version(tmp_path, '20260103-000000', {'scores.json': '{}'})
+    with open(os.path.join(broken_dir, 'scores.json'), 'w') as f:
+        f.write('{"changed": 1}')
+
+    model = MyModel.__new__(MyModel)
+    model.model_dir = str(tmp_path)
+    MyModel.publish(model.model_dir, '20260102-000000')
+    assert model._published_dir() == arrow_dir
+
+    MyModel.publish(model.model_dir, '20260103-000000')
+    assert model._published_dir() == arrow_dir
+
+    os.remove(os.path.join(arrow_dir, MyModel.MANIFEST_FILENAME))
+    assert model._published_dir() == good_dir
+
+    os.remove(os.path.join(good_dir, 'scores.json'))
+    assert model._published_dir() is None
+
+
+def test_micro_batch_fails_only_the_bad_request(model):
+    key = MODEL_KEYS[0]
+    rows = reference_rows(key).head(4).to_dict('records')
+    numeric = next(c for c in rows[0] if c.startswith('lv_'))
+    bad = dict(rows[0], **{numeric: 'not a number'})
+
+    batcher = MyMicroBatcher(model, window_ms=200)
+    try:
+        futures = [batcher.submit(row) for row in rows[:2] + [bad] + rows[2:]]
+        with pytest.raises(ValueError):
+            futures[2].result(timeout=30)
+        for row, future in zip(rows, futures[:2] + futures[3:]):
+            expected = model.predict_all_models(row)[key]['predict']
+            assert future.result(timeout=30)[key]['predict'] == expected
+    finally:
+        batcher.close()
+    assert batcher.stats()['batches'] == 1
+
+
+@pytest.mark.parametrize('key', MODEL_KEYS)
+def test_reference_frame_stays_on_the_memory_map(tmp_path, key):
+    store = MyReferenceStore(str(tmp_path))
+    reference = pd.read_csv(os.path.join(MODEL_DIR, f'original_{key}.csv'))
+    reference.to_csv(store.csv_path(key), index=False)
+    store.convert(key)
+
+    allocated = pa.total_allocated_bytes()
+    df = store.get(key)
+    # nothing copied out of the mapped file, string columns included
+    assert pa.total_allocated_bytes() == allocated
+    assert all(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes)
+    assert MyReferenceStore.compute_stats(df) == MyReferenceStore.compute_stats(reference)
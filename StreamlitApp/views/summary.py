@@ -3,17 +3,31 @@ from utils import get_user_health_records, get_health_status, logout_user
 
 import plotly.graph_objects as go
 import numpy as np
+import pandas as pd
 
-from MyPackage.myclass import MyModel, MyAIGenerator
+from MyPackage.myclass import MyModel, MyMicroBatcher, MyAIGenerator
 
-@st.cache_resource(ttl=3600)
+# score concurrent sessions together (see MyMicroBatcher), off by default
+USE_MICRO_BATCHING = False
+
+# no ttl: a retrained Models dir is picked up by mm.watch() without a restart
+@st.cache_resource
 def init_model():
-    mm = MyModel()
+    mm = MyModel(use_compiled=True, n_workers=5)
+    # load + prime every model in the background, see mm.ready / mm.warm_up_timings
+    mm.warm_up(background=True)
+    mm.watch(interval=30)
     return mm
 mm = init_model()
 
-@st.cache_resource(ttl=3600)
+@st.cache_resource
+def init_batcher():
+    return MyMicroBatcher(init_model(), window_ms=10)
+
+# MyModel caches per model on that model's own features
 def get_model_prediction(health_data):
+    if USE_MICRO_BATCHING:
+        return init_batcher().predict_all_models(health_data)
     prediction = mm.predict_all_models(health_data)
     return prediction
 
@@ -35,35 +49,35 @@ def get_ai_recommendations(health_data, google_api_key, model_name):
 
 
 
-def plot_feature(name, df, feature, mark_value):
+def plot_feature(name, reference, feature, mark_value):
     """
-    Dynamic plot for a given feature in dataframe.
+    Dynamic plot for a given feature of the reference data.
+    reference: the MyReferenceHandle from a prediction result, charts are
+    drawn from its precomputed statistics (no full-column scan)
     - Numeric → Bell curve
     - Category → Bar chart
     """
     print(feature)
 
-    col_data = df[feature].dropna()
+    feature_stats = reference.stats(feature)
 
     # Detect numeric column
-    is_numeric = np.issubdtype(col_data.dtype, np.number)
+    is_numeric = feature_stats['type'] == 'numeric'
 
     # ============================================================
     # NUMERIC → Bell Curve
     # ============================================================
     height = 100
     if is_numeric:
-        # สมมติ numeric column
-        data = df[feature].dropna().astype(float)
-
         # แปลง mark_value เป็น float
         try:
             mark_value_float = float(mark_value)
         except:
             mark_value_float = None  # กรณีแปลงไม่ได้ ให้ skip mark
 
-        # สร้าง histogram จากข้อมูลจริง
-        counts, bins = np.histogram(data, bins=20)  # ปรับ bins ได้
+        # histogram จากข้อมูลจริง (คำนวณไว้แล้วตอน train)
+        counts = np.array(feature_stats['counts'])
+        bins = np.array(feature_stats['bins'])
         bin_centers = 0.5 * (bins[1:] + bins[:-1])
 
         fig = go.Figure()
@@ -72,11 +86,13 @@ def plot_feature(name, df, feature, mark_value):
         # Highlight selected value
         if mark_value_float is not None:
             y_mark = counts[np.abs(bin_centers - mark_value_float).argmin()]
+            percentile = reference.percentile(feature, mark_value_float)
             fig.add_trace(go.Scatter(
                 x=[mark_value_float],
                 y=[y_mark],
                 mode="markers+text",
                 text=[str(mark_value_float)],
+                hovertext=[f"percentile {percentile:.0f}"] if percentile is not None else None,
                 textposition="bottom left",
                 marker=dict(size=12, color="red")
             ))
@@ -107,7 +123,7 @@ def plot_feature(name, df, feature, mark_value):
     # CATEGORY → Bar Chart
     # ============================================================
     else:
-        counts = col_data.value_counts()
+        counts = pd.Series(feature_stats['counts'], index=feature_stats['categories'])
 
         fig = go.Figure()
         fig.add_trace(go.Bar(x=counts.index, y=counts.values))
@@ -232,7 +248,7 @@ def summary_screen():
             name_decease = name_deceases[key]
             predict = ml_predictions[key]['predict']
             feature_input = ml_predictions[key]['feature_input']
-            original_df = ml_predictions[key]['original_df']
+            reference = ml_predictions[key]['reference']
 
             with col_d1:
                 st.write(name_decease)
@@ -240,13 +256,13 @@ def summary_screen():
                 st.write(predict)
             with col_d3:
                 # Inputs
-                columns = original_df.columns
+                columns = reference.columns
                 feature = columns[1]
 
                 # for feature in columns:
                 #     if feature not in ignore_feature:
                 #         st.write(feature)
-                #         plot_feature(key, original_df, feature, feature_input[feature])
+                #         plot_feature(key, reference, feature, feature_input[feature])
             
 
             